@@ -0,0 +1 @@
+default_app_config = 'defectDojo_engagement_survey.apps.EngagementSurveyConfig'
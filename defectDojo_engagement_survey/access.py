@@ -0,0 +1,79 @@
+'''
+System settings and product authorization lookups for the survey views.
+
+The System_Settings row is read by every answering page but changes
+rarely, so it is kept per process and checked against a version in the
+cache backend, the same way schema.py keeps survey schemas; signals.py
+bumps the version when the settings are saved. Within a request it is only
+looked up once.
+
+Product membership is answered with a single EXISTS query on the
+authorized users join table instead of loading every authorized user.
+'''
+import uuid
+
+from django.core.cache import cache
+
+from dojo.models import System_Settings
+
+from .metrics import cache_lookup
+
+VERSION_KEY = 'survey_system_settings_version'
+
+# (version, System_Settings) of this process
+_settings = [None, None]
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(VERSION_KEY, version, None)
+        version = cache.get(VERSION_KEY) or version
+    return version
+
+
+def system_settings(request=None):
+    '''
+    Returns the System_Settings, looked up at most once per request and
+    only from the database when they changed. Treat the result as read only.
+    '''
+    if request is not None and hasattr(request, '_survey_system_settings'):
+        return request._survey_system_settings
+
+    version = _version()
+    cached_version, settings = _settings
+    cache_lookup('system_settings', settings is not None and cached_version == version)
+    if settings is None or cached_version != version:
+        settings = System_Settings.objects.all()[0]
+        _settings[:] = [version, settings]
+
+    if request is not None:
+        request._survey_system_settings = settings
+    return settings
+
+
+def invalidate_system_settings():
+    '''
+    Marks the cached system settings as stale in every process
+    '''
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    _settings[:] = [None, None]
+
+
+def is_authorized(user, product):
+    '''
+    Tells whether a user is staff or one of the authorized users of a
+    product, with at most one query per user and product
+    '''
+    if user.is_staff:
+        return True
+    if product is None or user.is_anonymous:
+        return False
+
+    checked = getattr(user, '_survey_authorized_products', None)
+    if checked is None:
+        checked = user._survey_authorized_products = {}
+    if product.pk not in checked:
+        checked[product.pk] = product.authorized_users.filter(pk=user.pk).exists()
+    return checked[product.pk]
@@ -4,13 +4,48 @@ Created on Feb 21, 2015
 @author: jay7958
 '''
 from django.contrib import admin
+from django.db import transaction
 
 from polymorphic.admin import PolymorphicParentModelAdmin, \
     PolymorphicChildModelAdmin
 
 from .models import Question, TextQuestion, ChoiceQuestion, Choice
 from .models import Answer, TextAnswer, ChoiceAnswer, Engagement_Survey, \
-    Answered_Survey
+    Answered_Survey, Survey_Statistic, Survey_Submission
+from .statistics import rebuild_statistics
+
+
+class RecountStatisticsMixin(object):
+    """
+    Recounts the survey statistics touched by admin edits and deletes,
+    which don't go through statistics.py
+    """
+
+    survey_field = 'answered_survey__survey_id'
+
+    def _survey_ids(self, queryset):
+        return set(queryset.values_list(self.survey_field, flat=True))
+
+    def _recount(self, survey_ids):
+        survey_ids = sorted(survey_ids)
+        if survey_ids:
+            transaction.on_commit(lambda: rebuild_statistics(survey_ids))
+
+    def save_model(self, request, obj, form, change):
+        # the survey an edited row belonged to before, in case it changes
+        before = self._survey_ids(self.model._base_manager.filter(pk=obj.pk)) if change else set()
+        super(RecountStatisticsMixin, self).save_model(request, obj, form, change)
+        self._recount(before | self._survey_ids(self.model._base_manager.filter(pk=obj.pk)))
+
+    def delete_model(self, request, obj):
+        survey_ids = self._survey_ids(self.model._base_manager.filter(pk=obj.pk))
+        super(RecountStatisticsMixin, self).delete_model(request, obj)
+        self._recount(survey_ids)
+
+    def delete_queryset(self, request, queryset):
+        survey_ids = self._survey_ids(queryset)
+        super(RecountStatisticsMixin, self).delete_queryset(request, queryset)
+        self._recount(survey_ids)
 
 
 class QuestionChildAdmin(PolymorphicChildModelAdmin):
@@ -51,7 +86,7 @@ admin.site.register(Question, QuestionParentAdmin)
 admin.site.register(Choice)
 
 
-class AnswerChildAdmin(PolymorphicChildModelAdmin):
+class AnswerChildAdmin(RecountStatisticsMixin, PolymorphicChildModelAdmin):
     """
     Base admin class for all child Answer models
     """
@@ -71,7 +106,7 @@ class ChoiceAnswerAdmin(AnswerChildAdmin):
     """
 
 
-class AnswerParentAdmin(PolymorphicParentModelAdmin):
+class AnswerParentAdmin(RecountStatisticsMixin, PolymorphicParentModelAdmin):
     """
     The parent model admin for answer
     """
@@ -92,4 +127,16 @@ admin.site.register(TextAnswer, TextAnswerAdmin)
 admin.site.register(ChoiceAnswer, ChoiceAnswerAdmin)
 admin.site.register(Answer, AnswerParentAdmin)
 admin.site.register(Engagement_Survey)
-admin.site.register(Answered_Survey)
+
+
+class AnsweredSurveyAdmin(RecountStatisticsMixin, admin.ModelAdmin):
+    """
+    ModelAdmin for Answered_Survey
+    """
+
+    survey_field = 'survey_id'
+
+
+admin.site.register(Answered_Survey, AnsweredSurveyAdmin)
+admin.site.register(Survey_Submission)
+admin.site.register(Survey_Statistic)
@@ -0,0 +1,530 @@
+'''
+Bulk loading and saving of survey questions and answers.
+
+The answer tables are the record of every answer. With SURVEY_ANSWER_DOCUMENTS
+on, each Answered_Survey also keeps a compact JSON copy of its answers that
+write_answers() updates in the same transaction, so showing a survey reads
+a single row. While the setting is off the copies of the surveys written to
+are cleared, so a document is never stale. Answers changed any other way,
+such as in the admin or by deleting questions and choices, clear the copies
+of their surveys through the signal handlers, and reads fall back to the
+tables until the next submission.
+'''
+import json
+import time
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .metrics import ANSWER_SAVE_SECONDS, FORM_BUILD_SECONDS, SUBMISSION_ANSWERS
+from .models import Answer, Answered_Survey, ChoiceAnswer, TextAnswer
+from .schema import CHOICE, get_schema
+
+
+def answer_documents_enabled():
+    return getattr(settings, 'SURVEY_ANSWER_DOCUMENTS', False)
+
+
+def encode_answers(text_answers, choice_answers):
+    '''
+    Returns the JSON answers document of a survey, keyed by question id with
+    the text or the list of selected choice ids
+    '''
+    document = dict((str(qid), text) for qid, text in text_answers.items())
+    document.update((str(qid), list(choice_ids)) for qid, choice_ids in choice_answers.items())
+    return json.dumps(document, separators=(',', ':'), sort_keys=True)
+
+
+def encode_selection(choice_ids):
+    '''
+    Returns the compact form of a choice selection kept on ChoiceAnswer,
+    the sorted choice ids separated by commas
+    '''
+    return ','.join(str(choice_id) for choice_id in sorted(set(choice_ids)))
+
+
+def decode_selection(selected):
+    return [int(choice_id) for choice_id in selected.split(',') if choice_id]
+
+
+def decode_answers(document):
+    '''
+    Splits an answers document back into text and choice answers
+    '''
+    text_answers = {}
+    choice_answers = {}
+    for qid, value in json.loads(document).items():
+        if isinstance(value, list):
+            choice_answers[int(qid)] = value
+        else:
+            text_answers[int(qid)] = value
+    return text_answers, choice_answers
+
+
+def load_table_answers(answered_survey_ids, using=None):
+    '''
+    Returns the answers of several answered surveys from the answer tables
+    with two queries, as answered survey id to (text_answers, choice_answers)
+    '''
+    answers = dict((survey_id, ({}, {})) for survey_id in answered_survey_ids)
+    if not answers:
+        return answers
+
+    texts = TextAnswer.objects.using(using).filter(
+        answered_survey_id__in=list(answers)
+    ).values_list('answered_survey_id', 'question_id', 'answer')
+    for survey_id, question_id, text in texts:
+        answers[survey_id][0][question_id] = text
+
+    selected = ChoiceAnswer.answer.through.objects.using(using).filter(
+        choiceanswer__answered_survey_id__in=list(answers)
+    ).order_by('choice__order').values_list(
+        'choiceanswer__answered_survey_id', 'choiceanswer__question_id', 'choice_id')
+    for survey_id, question_id, choice_id in selected:
+        answers[survey_id][1].setdefault(question_id, []).append(choice_id)
+
+    return answers
+
+
+def load_answers(answered_survey):
+    '''
+    Returns the stored answers of an Answered_Survey as question id to text
+    and question id to selected choice ids. They come from the survey's own
+    answers document when SURVEY_ANSWER_DOCUMENTS is on and the document is
+    up to date, otherwise from the answer tables with two queries.
+    '''
+    # a survey that hasn't been saved yet can't have answers
+    if answered_survey is None or not answered_survey.pk:
+        return {}, {}
+
+    if answer_documents_enabled() and answered_survey.answers_document is not None:
+        return decode_answers(answered_survey.answers_document)
+
+    return load_table_answers([answered_survey.pk])[answered_survey.pk]
+
+
+class SurveyAnswers(object):
+    '''
+    The questions, choices and existing answers of a survey, fetched with a
+    constant number of queries and handed to the question forms. Questions
+    come from the cached survey schema. Callers that looked up the questions
+    or answers already, like async_views, can pass them in.
+    '''
+
+    def __init__(self, engagement_survey, answered_survey=None, questions=None, answers=None):
+        self.engagement_survey = engagement_survey
+        self.answered_survey = answered_survey
+
+        if questions is None:
+            questions = get_schema(engagement_survey).questions
+        self.questions = questions
+
+        if answers is None:
+            answers = load_answers(answered_survey)
+        self.text_answers, self.choice_answers = answers
+
+    def initial(self, question):
+        '''
+        Returns the stored answer for a question
+        '''
+        if question.type == CHOICE:
+            return self.choice_answers.get(question.id, [])
+        return self.text_answers.get(question.id, '')
+
+    def forms(self, data=None, read_only=False):
+        '''
+        Returns one bound or unbound form per question
+        '''
+        if self.answered_survey is not None:
+            survey_kwargs = {'answered_survey': self.answered_survey}
+        else:
+            survey_kwargs = {'engagement_survey': self.engagement_survey}
+
+        start = time.perf_counter()
+        forms = [q.get_form()(data,
+                              prefix=str(q.id),
+                              question=q,
+                              initial_answer=self.initial(q),
+                              form_tag=False,
+                              **survey_kwargs)
+                 for q in self.questions]
+        if forms:
+            FORM_BUILD_SECONDS.observe((time.perf_counter() - start) / len(forms))
+
+        if read_only:
+            for form in forms:
+                form.fields['answer'].widget.attrs = {"readonly": "readonly",
+                                                      "disabled": "disabled"}
+        return forms
+
+
+def answer_values(forms):
+    '''
+    Returns the answers of validated question forms as two dicts, question
+    id to text and question id to the list of selected choice ids. Empty
+    answers are skipped, like the forms' own save() does.
+    '''
+    text_values = {}
+    choice_values = {}
+
+    for form in forms:
+        if not form.is_valid():
+            raise ValueError('Question %s has an invalid answer' % form.question.id)
+
+        answer = form.cleaned_data.get('answer')
+        if form.question.type == CHOICE:
+            choice_ids = [int(choice) for choice in answer or [] if choice]
+            if choice_ids:
+                choice_values[form.question.id] = choice_ids
+        elif answer:
+            text_values[form.question.id] = answer
+
+    return text_values, choice_values
+
+
+def save_answers(answered_survey, forms):
+    '''
+    Writes the answers of validated question forms for an Answered_Survey in
+    one transaction. Concurrent submissions of the same survey wait for each
+    other and never duplicate an answer.
+    '''
+    text_values, choice_values = answer_values(forms)
+    answers = len(text_values) + len(choice_values)
+    SUBMISSION_ANSWERS.observe(answers)
+    if not answers:
+        return
+
+    start = time.perf_counter()
+    using = router.db_for_write(Answer)
+    with transaction.atomic(using=using):
+        list(Answered_Survey.objects.using(using).select_for_update().filter(
+            pk=answered_survey.pk).values_list('pk', flat=True))
+        documents = write_answers({answered_survey.pk: (text_values, choice_values)}, using)
+    answered_survey.answers_document = documents[answered_survey.pk]
+    ANSWER_SAVE_SECONDS.observe((time.perf_counter() - start) / answers)
+
+
+def write_answers(submissions, using=None):
+    '''
+    Writes the answers of any number of answered surveys, given as a dict of
+    answered survey id to (text_values, choice_values) as returned by
+    answer_values(). Every table is written with one upsert per batch, so
+    the number of statements doesn't grow with the number of questions or
+    surveys. The survey statistics are adjusted once the transaction commits.
+    Returns the new answers document of every survey written.
+    '''
+    if using is None:
+        using = router.db_for_write(Answer)
+
+    text_values = {}
+    choice_values = {}
+    for survey_id, (texts, choices) in submissions.items():
+        text_values.update(((survey_id, qid), text) for qid, text in texts.items())
+        choice_values.update(((survey_id, qid), choice_ids) for qid, choice_ids in choices.items())
+    if not text_values and not choice_values:
+        return {}
+
+    # statistics.py builds on this module
+    from .statistics import record_statistics
+
+    with transaction.atomic(using=using):
+        statistics = _statistics_deltas(submissions, text_values, choice_values, using)
+        answer_ids = _upsert_answers(text_values, choice_values, using)
+
+        _upsert_children(TextAnswer, 'answer',
+                         [(answer_ids[key], text) for key, text in text_values.items()], using)
+        _upsert_children(ChoiceAnswer, 'selected',
+                         [(answer_ids[key], encode_selection(choice_ids)) for key, choice_ids in choice_values.items()],
+                         using)
+
+        # choice selections are replaced as a whole
+        through = ChoiceAnswer.answer.through
+        through.objects.using(using).filter(
+            choiceanswer_id__in=[answer_ids[key] for key in choice_values]
+        ).delete()
+        through.objects.using(using).bulk_create([
+            through(choiceanswer_id=answer_ids[key], choice_id=choice_id)
+            for key, choice_ids in choice_values.items()
+            for choice_id in choice_ids
+        ], ignore_conflicts=True)
+
+        Answer.objects.non_polymorphic().using(using).filter(
+            id__in=list(answer_ids.values())
+        ).update(modified=timezone.now())
+
+        record_statistics(statistics, using)
+        return _write_documents(submissions, using)
+
+
+def _statistics_deltas(submissions, text_values, choice_values, using):
+    '''
+    Works out how answers about to be written change the survey statistics,
+    from the answers they replace
+    '''
+    survey_ids = dict(Answered_Survey._base_manager.using(using).filter(
+        pk__in=list(submissions)).values_list('pk', 'survey_id'))
+    keys = set(text_values) | set(choice_values)
+    previous = dict(((sid, qid), selected) for sid, qid, selected in Answer.objects.non_polymorphic().using(using).filter(
+        answered_survey_id__in=set(sid for sid, qid in keys),
+        question_id__in=set(qid for sid, qid in keys),
+    ).values_list('answered_survey_id', 'question_id', 'choiceanswer__selected') if (sid, qid) in keys)
+
+    deltas = Counter()
+    for sid, qid in keys:
+        if (sid, qid) not in previous:
+            deltas[(survey_ids[sid], qid, 0)] += 1
+    for (sid, qid), choice_ids in choice_values.items():
+        before = set(decode_selection(previous.get((sid, qid)) or ''))
+        after = set(choice_ids)
+        for choice_id in after - before:
+            deltas[(survey_ids[sid], qid, choice_id)] += 1
+        for choice_id in before - after:
+            deltas[(survey_ids[sid], qid, choice_id)] -= 1
+    return deltas
+
+
+def _write_documents(submissions, using):
+    '''
+    Merges freshly written answers into the answers documents of their
+    surveys, or clears the documents while SURVEY_ANSWER_DOCUMENTS is off
+    '''
+    surveys = Answered_Survey._base_manager.using(using).filter(pk__in=list(submissions))
+    if not answer_documents_enabled():
+        forget_documents(surveys)
+        return dict.fromkeys(submissions)
+
+    documents = dict(surveys.values_list('pk', 'answers_document'))
+    # an unknown document is rebuilt from the tables, which already hold the new answers
+    rebuilt = load_table_answers([pk for pk, document in documents.items() if document is None], using)
+    for survey_id, (texts, choices) in submissions.items():
+        if survey_id in rebuilt:
+            documents[survey_id] = encode_answers(*rebuilt[survey_id])
+        else:
+            text_answers, choice_answers = decode_answers(documents[survey_id])
+            text_answers.update(texts)
+            choice_answers.update(choices)
+            documents[survey_id] = encode_answers(text_answers, choice_answers)
+
+    Answered_Survey._base_manager.using(using).bulk_update(
+        [Answered_Survey(pk=pk, answers_document=document) for pk, document in documents.items()],
+        ['answers_document'])
+    return documents
+
+
+def _upsert_answers(text_values, choice_values, using):
+    '''
+    Inserts the base Answer rows that don't exist yet and returns a mapping
+    of (answered survey id, question id) to answer id, read back so it works
+    on backends that don't return ids from a bulk insert.
+    '''
+    text_type = ContentType.objects.get_for_model(TextAnswer, for_concrete_model=False)
+    choice_type = ContentType.objects.get_for_model(ChoiceAnswer, for_concrete_model=False)
+
+    Answer.objects.using(using).bulk_create(
+        [Answer(answered_survey_id=sid, question_id=qid, polymorphic_ctype=text_type)
+         for sid, qid in text_values] +
+        [Answer(answered_survey_id=sid, question_id=qid, polymorphic_ctype=choice_type)
+         for sid, qid in choice_values],
+        ignore_conflicts=True)
+
+    keys = set(text_values) | set(choice_values)
+    rows = Answer.objects.non_polymorphic().using(using).filter(
+        answered_survey_id__in=set(sid for sid, qid in keys),
+        question_id__in=set(qid for sid, qid in keys),
+    ).values_list('answered_survey_id', 'question_id', 'id')
+    return dict(((sid, qid), answer_id) for sid, qid, answer_id in rows if (sid, qid) in keys)
+
+
+def supports_upsert(connection):
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    return connection.vendor in ('postgresql', 'mysql')
+
+
+def _upsert_children(model, field_name, rows, using):
+    '''
+    Inserts or updates the child table rows of an answer model, given as
+    (answer id, value) pairs, with INSERT ... ON CONFLICT, or an insert and
+    an update where the backend has no native upsert.
+    '''
+    if not rows:
+        return
+
+    connection = connections[using]
+    if not supports_upsert(connection):
+        insert_children(model, [field_name], rows, using, ignore_conflicts=True)
+        _update_children(model, field_name, rows, using)
+        return
+
+    quote_name = connection.ops.quote_name
+    pk_field = model._meta.pk
+    value_field = model._meta.get_field(field_name)
+    pk_column = quote_name(pk_field.column)
+    value_column = quote_name(value_field.column)
+
+    if connection.vendor == 'mysql':
+        conflict = 'ON DUPLICATE KEY UPDATE %s = VALUES(%s)' % (value_column, value_column)
+    else:
+        conflict = 'ON CONFLICT (%s) DO UPDATE SET %s = excluded.%s' % (pk_column, value_column, value_column)
+
+    batch_size = max(connection.ops.bulk_batch_size([pk_field, value_field], rows), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                'INSERT INTO ' + quote_name(model._meta.db_table) +
+                ' (' + pk_column + ', ' + value_column + ') VALUES ' +
+                ', '.join(['(%s, %s)'] * len(batch)) + ' ' + conflict,
+                [value for row in batch for value in row])
+
+
+def insert_children(model, field_names, rows, using, ignore_conflicts=False):
+    '''
+    Inserts the child table rows of a multi-table inherited answer model.
+    bulk_create refuses these models, so rows (parent id first) go through
+    the same insert the ORM uses for the child table of a single save().
+    '''
+    if not rows:
+        return
+
+    fields = [model._meta.pk] + [model._meta.get_field(name) for name in field_names]
+    objs = []
+    for row in rows:
+        obj = model(**dict(zip(field_names, row[1:])))
+        setattr(obj, model._meta.pk.attname, row[0])
+        objs.append(obj)
+
+    batch_size = max(connections[using].ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), batch_size):
+        model._base_manager._insert(objs[start:start + batch_size], fields=fields, using=using,
+                                    ignore_conflicts=ignore_conflicts)
+
+
+def _update_children(model, field_name, rows, using):
+    '''
+    Bulk updates existing child table rows given as (answer id, value) pairs
+    '''
+    model._base_manager.using(using).bulk_update(
+        [model(**{'pk': answer_id, field_name: value}) for answer_id, value in rows],
+        [field_name])
+
+
+def rebuild_documents(batch_size=1000, verify=False):
+    '''
+    Rewrites the answers document of every answered survey from the answer
+    tables, batch_size surveys per transaction. With verify, only counts the
+    documents that differ from the tables. Returns the number of documents
+    rewritten or found to differ.
+    '''
+    using = router.db_for_write(Answered_Survey)
+    surveys = Answered_Survey._base_manager.using(using).order_by('pk')
+    changed = 0
+    last = 0
+
+    while True:
+        with transaction.atomic(using=using):
+            batch = list(surveys.filter(pk__gt=last).values_list('pk', 'answers_document')[:batch_size])
+            if not batch:
+                break
+            last = batch[-1][0]
+
+            answers = load_table_answers([pk for pk, document in batch], using)
+            # a missing document is valid, reads fall back to the tables
+            stale = [(pk, encode_answers(*answers[pk])) for pk, document in batch
+                     if (document is None and not verify) or
+                     (document is not None and not _same_answers(decode_answers(document), answers[pk]))]
+            changed += len(stale)
+            if stale and not verify:
+                Answered_Survey._base_manager.using(using).bulk_update(
+                    [Answered_Survey(pk=pk, answers_document=document) for pk, document in stale],
+                    ['answers_document'])
+
+    return changed
+
+
+def forget_documents(answered_surveys):
+    '''
+    Clears the answers documents of an Answered_Survey queryset, for answers
+    changed outside write_answers()
+    '''
+    return answered_surveys.exclude(answers_document=None).update(answers_document=None)
+
+
+def resync_selections(choice_answer_ids, using=None):
+    '''
+    Re-encodes the compact selections of choice answers whose
+    ChoiceAnswer.answer rows were edited directly, e.g. in the admin
+    '''
+    if using is None:
+        using = router.db_for_write(ChoiceAnswer)
+    picked = dict((pk, []) for pk in choice_answer_ids)
+    for answer_id, choice_id in ChoiceAnswer.answer.through.objects.using(using).filter(
+            choiceanswer_id__in=list(picked)).values_list('choiceanswer_id', 'choice_id'):
+        picked[answer_id].append(choice_id)
+    _update_children(ChoiceAnswer, 'selected',
+                     [(pk, encode_selection(choice_ids)) for pk, choice_ids in picked.items()], using)
+    forget_documents(Answered_Survey._base_manager.using(using).filter(
+        answer__id__in=list(picked)))
+
+
+def _same_answers(stored, expected):
+    # selections are compared regardless of their order
+    return stored[0] == expected[0] and \
+        dict((qid, sorted(ids)) for qid, ids in stored[1].items()) == \
+        dict((qid, sorted(ids)) for qid, ids in expected[1].items())
+
+
+def mark_completed(answered_survey, responder):
+    '''
+    Records an answered survey as completed today by responder, counting
+    it in the survey statistics unless it already was
+    '''
+    from .statistics import record_statistics
+
+    using = router.db_for_write(Answered_Survey)
+    with transaction.atomic(using=using):
+        # the conditional UPDATE lets only one of two concurrent submissions count
+        if Answered_Survey._base_manager.using(using).filter(
+                pk=answered_survey.pk, completed=False).update(completed=True):
+            record_statistics({(answered_survey.survey_id, 0, 0): 1}, using)
+        answered_survey.completed = True
+        answered_survey.responder = responder
+        answered_survey.answered_on = date.today()
+        answered_survey.save(using=using)
+
+
+def reset_completion(answered_surveys):
+    '''
+    Marks answered surveys as not completed with a single UPDATE and
+    returns how many were actually reset.
+    '''
+    from .statistics import completion_statistics, negated, record_statistics
+
+    using = router.db_for_write(Answered_Survey)
+    answered_surveys = answered_surveys.using(using)
+    with transaction.atomic(using=using):
+        completed = completion_statistics(answered_surveys)
+        reset = answered_surveys.filter(completed=True).update(completed=False, answered_on=None)
+        # the questions changed, the next read rebuilds the documents from the tables
+        forget_documents(answered_surveys)
+        record_statistics(negated(completed), using)
+    return reset
+
+
+def strip_choice(choice_id):
+    '''
+    Takes a choice that is being deleted out of the compact selections that
+    picked it; the collector removes its selection rows
+    '''
+    using = router.db_for_write(ChoiceAnswer)
+    rows = list(ChoiceAnswer._base_manager.using(using).filter(answer=choice_id).values_list(
+        'pk', 'selected', 'answered_survey_id'))
+    _update_children(ChoiceAnswer, 'selected',
+                     [(pk, encode_selection([c for c in decode_selection(selected) if c != choice_id]))
+                      for pk, selected, survey_id in rows], using)
+    forget_documents(Answered_Survey._base_manager.using(using).filter(
+        pk__in=set(survey_id for pk, selected, survey_id in rows)))
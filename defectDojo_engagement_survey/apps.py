@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class EngagementSurveyConfig(AppConfig):
+    name = 'defectDojo_engagement_survey'
+    verbose_name = 'DefectDojo Engagement Survey'
+
+    def ready(self):
+        # connect the signal handlers
+        from . import signals  # noqa: F401
+
+        if getattr(settings, 'SURVEY_SLOW_QUERY_MS', None) is not None:
+            from .slowqueries import install
+            install()
+
+        # the periodic sweeper and intake jobs run in their own process, see
+        # the run_survey_workers command, never in every process loading the app
@@ -0,0 +1,95 @@
+'''
+Async versions of the survey answering views, for ASGI deployments.
+
+They run the lookups that don't depend on each other (engagement and
+product, answered survey, survey schema and existing answers) concurrently
+in worker threads and hand the results to the same respond functions as
+the sync views, so a slow database round trip no longer holds the request's
+thread. The system settings are read on the request's thread, which owns
+the request object.
+
+Needs Django 3.1 or 3.2, see the async extra in setup.py; enable with
+SURVEY_ASYNC_VIEWS = True. Django's async ORM only arrived in 4.1, which
+the rest of the app doesn't run on yet, so the lookups go through
+sync_to_async.
+'''
+import asyncio
+import functools
+
+import django
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from django.shortcuts import get_object_or_404
+
+from dojo.models import Engagement
+
+from .access import system_settings
+from .answers import SurveyAnswers, load_answers
+from .models import Answered_Survey, General_Survey
+from .pages import get_blank_page
+from .schema import get_schema
+from .views import check_answer_permission, respond_answer_empty_survey, respond_answer_survey
+
+if django.VERSION < (3, 1):
+    raise ImproperlyConfigured('Async survey views need Django 3.1 or later, install the async extra')
+
+
+def _closing(func):
+    # lookups run on pool threads, which Django's request signals never reach
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+def _lookup(func, *args, **kwargs):
+    '''
+    Runs a blocking lookup on its own thread so several can run at once
+    '''
+    return sync_to_async(_closing(func), thread_sensitive=False)(*args, **kwargs)
+
+
+def _respond_answer_survey(request, settings, engagement, survey, answers):
+    check_answer_permission(request, settings, engagement.product)
+    return respond_answer_survey(request, engagement, survey, answers)
+
+
+def _respond_answer_empty_survey(request, settings, general_survey, answers):
+    check_answer_permission(request, settings)
+    return respond_answer_empty_survey(request, general_survey, answers)
+
+
+async def answer_survey(request, eid, sid):
+    survey, engagement, settings = await asyncio.gather(
+        _lookup(get_object_or_404, Answered_Survey.objects.select_related('survey'), id=sid),
+        _lookup(get_object_or_404, Engagement.objects.select_related('product'), id=eid),
+        sync_to_async(system_settings)(request))
+
+    schema, stored = await asyncio.gather(
+        _lookup(get_schema, survey.survey_id),
+        _lookup(load_answers, survey))
+    answers = SurveyAnswers(survey.survey, answered_survey=survey,
+                            questions=schema.questions, answers=stored)
+
+    # permission, forms and the answer transaction stay on the request's thread
+    return await sync_to_async(_respond_answer_survey)(request, settings, engagement, survey, answers)
+
+
+async def answer_empty_survey(request, esid):
+    page = await sync_to_async(get_blank_page)(request, esid)
+    if page is not None:
+        return page
+
+    general_survey, settings = await asyncio.gather(
+        # expired surveys can't be answered, cached pages expire with their survey
+        _lookup(get_object_or_404, General_Survey.objects.open().select_related('survey'), id=esid),
+        sync_to_async(system_settings)(request))
+
+    schema = await _lookup(get_schema, general_survey.survey_id)
+    answers = SurveyAnswers(general_survey.survey, questions=schema.questions, answers=({}, {}))
+
+    return await sync_to_async(_respond_answer_empty_survey)(request, settings, general_survey, answers)
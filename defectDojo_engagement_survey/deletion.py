@@ -0,0 +1,183 @@
+'''
+Set based deletion of answered surveys and their answers.
+
+Django's delete collector loads every answer and choice selection into
+memory before removing them one model at a time. These helpers issue a few
+DELETE statements with subqueries instead: choice selections, the answer
+child tables, the answers and finally the answered surveys.
+'''
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import router, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Answer, Answered_Survey, ChoiceAnswer, General_Survey, Survey_Submission, TextAnswer
+from .statistics import answer_statistics, completion_statistics, negated, record_statistics
+
+
+def _delete_answers(answers, using, statistics=True):
+    '''
+    Deletes the rows of an Answer queryset and everything hanging off them,
+    taking them out of the survey statistics. Returns the number of answers
+    deleted.
+    '''
+    if statistics:
+        record_statistics(negated(answer_statistics(answers)), using)
+    answer_ids = answers.values('id')
+    ChoiceAnswer.answer.through.objects.using(using).filter(
+        choiceanswer_id__in=answer_ids)._raw_delete(using)
+    TextAnswer._base_manager.using(using).filter(
+        answer_ptr_id__in=answer_ids)._raw_delete(using)
+    ChoiceAnswer._base_manager.using(using).filter(
+        answer_ptr_id__in=answer_ids)._raw_delete(using)
+    return answers._raw_delete(using)
+
+
+def _delete_surveys(answered_surveys, using, statistics=True):
+    if statistics:
+        record_statistics(negated(completion_statistics(answered_surveys)), using)
+    answered_surveys._raw_delete(using)
+
+
+def delete_answered_surveys(answered_surveys, chunk_size=None, statistics=True):
+    '''
+    Deletes an Answered_Survey queryset with all of its answers.
+
+    Without a chunk_size everything goes in one transaction. With one, the
+    answers are removed chunk_size at a time, each batch in its own
+    transaction, so that very large surveys never hold locks for long.
+    The survey statistics are adjusted unless statistics is False, for
+    surveys that are going away with their statistics.
+    Returns the number of answers deleted.
+    '''
+    using = router.db_for_write(Answered_Survey)
+    survey_ids = answered_surveys.using(using).values('id')
+    answers = Answer.objects.non_polymorphic().using(using).filter(answered_survey__in=survey_ids)
+    deleted = 0
+
+    if chunk_size is None:
+        with transaction.atomic(using=using):
+            deleted = _delete_answers(answers, using, statistics)
+            _delete_surveys(answered_surveys.using(using), using, statistics)
+        return deleted
+
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(answers.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            deleted += _delete_answers(Answer.objects.non_polymorphic().using(using).filter(id__in=ids), using,
+                                       statistics)
+
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(answered_surveys.using(using).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            _delete_surveys(Answered_Survey._base_manager.using(using).filter(id__in=ids), using, statistics)
+
+    return deleted
+
+
+def delete_survey_answers(survey, chunk_size=None, statistics=True):
+    '''
+    Removes every answered instance of an Engagement_Survey, including the
+    anonymous responses to its general surveys. chunk_size defaults to the
+    SURVEY_DELETE_CHUNK_SIZE setting, False forces a single transaction.
+    '''
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'SURVEY_DELETE_CHUNK_SIZE', None)
+    return delete_answered_surveys(Answered_Survey.objects.filter(survey=survey), chunk_size or None, statistics)
+
+
+def delete_survey_with_answers(survey, chunk_size=None):
+    '''
+    Deletes an Engagement_Survey with everything answered for it, without
+    touching the survey statistics, which go with the survey.
+
+    With a chunk_size, which defaults to the SURVEY_DELETE_CHUNK_SIZE
+    setting, the answers are removed first, in batches with a transaction
+    each. The survey and whatever is left of its answered surveys are then
+    deleted in one transaction, through the survey_deleted handler. A failure
+    part way leaves the survey in place with fewer answers, and deleting it
+    again carries on where it stopped.
+    '''
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'SURVEY_DELETE_CHUNK_SIZE', None)
+    if chunk_size:
+        delete_survey_answers(survey, chunk_size, statistics=False)
+    survey.delete()
+
+
+def delete_engagement_answers(engagement, chunk_size=None):
+    '''
+    Removes every survey answered for an Engagement
+    '''
+    return delete_answered_surveys(Answered_Survey.objects.filter(engagement=engagement), chunk_size)
+
+
+def unlink_general_survey(general_survey):
+    '''
+    Keeps the responses given to a general survey that is being deleted,
+    without the link to it
+    '''
+    Answered_Survey.objects.filter(general_survey=general_survey).update(general_survey=None)
+
+
+def delete_preview(survey):
+    '''
+    Counts what deleting an Engagement_Survey removes, with one aggregate
+    query per table instead of collecting every related object.
+    Returns a list of (label, count) pairs.
+    '''
+    answered = Answered_Survey.objects.filter(survey=survey).aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(completed=True)))
+
+    text_type = ContentType.objects.get_for_model(TextAnswer, for_concrete_model=False)
+    choice_type = ContentType.objects.get_for_model(ChoiceAnswer, for_concrete_model=False)
+    answers = Answer.objects.non_polymorphic().filter(answered_survey__survey=survey).aggregate(
+        text=Count('id', filter=Q(polymorphic_ctype=text_type)),
+        choice=Count('id', filter=Q(polymorphic_ctype=choice_type)))
+
+    selected = ChoiceAnswer.answer.through.objects.filter(
+        choiceanswer__answered_survey__survey=survey).count()
+
+    return [
+        (Answered_Survey._meta.verbose_name_plural, answered['total']),
+        ('Completed ' + Answered_Survey._meta.verbose_name_plural, answered['completed']),
+        ('Text Answers', answers['text']),
+        ('Choice Answers', answers['choice']),
+        ('Selected Choices', selected),
+        (General_Survey._meta.verbose_name_plural, General_Survey.objects.filter(survey=survey).count()),
+    ]
+
+
+def sweep_expired_general_surveys(chunk_size=1000, now=None):
+    '''
+    Deletes expired general surveys together with the anonymous answers
+    given to them, chunk_size rows per transaction. Responses that were
+    since linked to an engagement are kept. General surveys with responses
+    still in the intake queue are left for a later sweep. Returns the
+    number of general surveys deleted.
+    '''
+    if now is None:
+        now = timezone.now()
+
+    expired = General_Survey.objects.filter(expiration__lt=now).exclude(
+        id__in=Survey_Submission.objects.values('general_survey_id'))
+    delete_answered_surveys(Answered_Survey.objects.filter(general_survey__in=expired.values('id'),
+                                                           engagement__isnull=True),
+                            chunk_size)
+
+    deleted = 0
+    while True:
+        with transaction.atomic(using=router.db_for_write(General_Survey)):
+            ids = list(expired.order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            # through the ORM so the cached blank pages get dropped
+            General_Survey.objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+    return deleted
@@ -14,6 +14,8 @@ from dojo.models import User, Product
 
 from .models import Engagement_Survey, Answered_Survey, TextAnswer, ChoiceAnswer, Choice, Question, TextQuestion, \
     ChoiceQuestion, General_Survey
+from .answers import save_answers
+from .schema import compile_question
 
 
 # List of validator_name:func_name
@@ -48,7 +50,15 @@ class QuestionForm(forms.Form):
         if not self.question:
             raise ValueError('Need a question to render')
 
+        # forms work on the compiled question, see schema.py
+        if isinstance(self.question, Question):
+            self.question = compile_question(self.question)
+
         del kwargs['question']
+
+        # answer preloaded by answers.SurveyAnswers, None means look it up
+        self.initial_answer = kwargs.pop('initial_answer', None)
+
         super(QuestionForm, self).__init__(*args, **kwargs)
 
 
@@ -58,15 +68,18 @@ class TextQuestionForm(QuestionForm):
 
         # work out initial data
 
-        initial_answer = TextAnswer.objects.filter(
-            answered_survey=self.answered_survey,
-            question=self.question
-        )
+        initial_answer = self.initial_answer
 
-        if initial_answer.exists():
-            initial_answer = initial_answer[0].answer
-        else:
-            initial_answer = ''
+        if initial_answer is None:
+            initial_answer = TextAnswer.objects.filter(
+                answered_survey=self.answered_survey,
+                question_id=self.question.id
+            )
+
+            if initial_answer.exists():
+                initial_answer = initial_answer[0].answer
+            else:
+                initial_answer = ''
 
         self.fields['answer'] = forms.CharField(
             label=self.question.text,
@@ -88,38 +101,35 @@ class TextQuestionForm(QuestionForm):
                 raise forms.ValidationError('Required')
             return
 
-        text_answer, created = TextAnswer.objects.get_or_create(
-            answered_survey=self.answered_survey,
-            question=self.question,
-        )
-
-        if created:
-            text_answer.answered_survey = self.answered_survey
-        text_answer.answer = answer
-        text_answer.save()
+        # through answers.py so the survey's answers document stays in step
+        save_answers(self.answered_survey, [self])
 
 
 class ChoiceQuestionForm(QuestionForm):
     def __init__(self, *args, **kwargs):
         super(ChoiceQuestionForm, self).__init__(*args, **kwargs)
 
-        choices = [(c.id, c.label) for c in self.question.choices.all()]
+        choices = [(c.id, c.label) for c in self.question.choices]
 
         # initial values
 
-        initial_choices = []
-        choice_answer = ChoiceAnswer.objects.filter(
-            answered_survey=self.answered_survey,
-            question=self.question,
-        ).annotate(a=Count('answer')).filter(a__gt=0)
+        initial_choices = self.initial_answer
+
+        if initial_choices is None:
+            initial_choices = []
+            choice_answer = ChoiceAnswer.objects.filter(
+                answered_survey=self.answered_survey,
+                question_id=self.question.id,
+            ).annotate(a=Count('answer')).filter(a__gt=0)
+
+            # we have ChoiceAnswer instance
+            if choice_answer:
+                choice_answer = choice_answer[0]
+                initial_choices = choice_answer.answer.all().values_list('id',
+                                                                         flat=True)
 
-        # we have ChoiceAnswer instance
-        if choice_answer:
-            choice_answer = choice_answer[0]
-            initial_choices = choice_answer.answer.all().values_list('id',
-                                                                     flat=True)
-            if self.question.multichoice is False:
-                initial_choices = initial_choices[0]
+        if initial_choices and self.question.multichoice is False:
+            initial_choices = initial_choices[0]
 
         # default classes
         widget = forms.RadioSelect
@@ -165,32 +175,27 @@ class ChoiceQuestionForm(QuestionForm):
                 raise forms.ValidationError('Required')
             return
 
-        choices = Choice.objects.filter(id__in=real_answer)
+        save_answers(self.answered_survey, [self])
 
-        # find ChoiceAnswer and filter in answer !
-        choice_answer = ChoiceAnswer.objects.filter(
-            answered_survey=self.answered_survey,
-            question=self.question,
-        )
-
-        # we have ChoiceAnswer instance
-        if choice_answer:
-            choice_answer = choice_answer[0]
 
-        if not choice_answer:
-            # create a ChoiceAnswer
-            choice_answer = ChoiceAnswer.objects.create(
-                answered_survey=self.answered_survey,
-                question=self.question
-            )
+class SurveyChoicesMixin(object):
+    '''
+    Offers an already loaded list of surveys, passed as surveys=, in the
+    survey field instead of querying them again while rendering
+    '''
 
-        # re save out the choices
-        choice_answer.answered_survey = self.answered_survey
-        choice_answer.answer = choices
-        choice_answer.save()
+    def __init__(self, *args, **kwargs):
+        surveys = kwargs.pop('surveys', None)
+        super(SurveyChoicesMixin, self).__init__(*args, **kwargs)
+        if surveys is not None:
+            field = self.fields['survey']
+            # a submitted survey is still looked up, among the offered ones
+            field.queryset = Engagement_Survey.objects.filter(pk__in=[survey.pk for survey in surveys])
+            field.choices = [('', field.empty_label)] + [(survey.pk, field.label_from_instance(survey))
+                                                         for survey in surveys]
 
 
-class Add_Survey_Form(forms.ModelForm):
+class Add_Survey_Form(SurveyChoicesMixin, forms.ModelForm):
     survey = forms.ModelChoiceField(
         queryset=Engagement_Survey.objects.all(),
         required=True,
@@ -206,7 +211,7 @@ class Add_Survey_Form(forms.ModelForm):
                    'assignee')
 
 
-class AddGeneralSurveyForm(forms.ModelForm):
+class AddGeneralSurveyForm(SurveyChoicesMixin, forms.ModelForm):
     survey = forms.ModelChoiceField(
         queryset=Engagement_Survey.objects.all(),
         required=True,
@@ -398,3 +403,16 @@ class AddEngagementForm(forms.Form):
         required=True,
         widget=forms.widgets.Select(),
         help_text='Select which product to attach Engagment')
+
+
+class SurveyReportForm(forms.Form):
+    products = forms.ModelMultipleChoiceField(
+        queryset=Product.objects.all(),
+        required=False,
+        help_text='Only answers given for these products, all when none is selected')
+    start = forms.DateField(required=False, widget=forms.TextInput(
+        attrs={'class': 'datepicker', 'autocomplete': 'off'}))
+    end = forms.DateField(required=False, widget=forms.TextInput(
+        attrs={'class': 'datepicker', 'autocomplete': 'off'}))
+    include_incomplete = forms.BooleanField(required=False,
+                                            help_text='Include answers of surveys not marked completed')
@@ -0,0 +1,140 @@
+'''
+Write-behind intake of general survey responses.
+
+With SURVEY_INTAKE_QUEUE enabled, answer_empty_survey only validates a
+response and queues it as a single Survey_Submission row. Queued responses
+are written out in batches by drain_submissions(), run by the
+drain_survey_intake or run_survey_workers management command, which
+smooths the database write load of a burst of respondents. The queue lives
+in the database, so no broker is needed, and any number of drainers can
+run against it.
+'''
+import json
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .answers import answer_values, write_answers
+from .metrics import SUBMISSION_ANSWERS
+from .models import Answered_Survey, Choice, General_Survey, Question, Survey_Submission
+from .statistics import record_statistics
+
+
+def intake_enabled():
+    return getattr(settings, 'SURVEY_INTAKE_QUEUE', False)
+
+
+def enqueue_submission(general_survey, responder, forms):
+    '''
+    Queues the answers of validated question forms with one INSERT
+    '''
+    text_values, choice_values = answer_values(forms)
+    SUBMISSION_ANSWERS.observe(len(text_values) + len(choice_values))
+    return Survey_Submission.objects.create(
+        general_survey=general_survey,
+        responder=responder,
+        answers=json.dumps({'text': text_values, 'choice': choice_values}))
+
+
+def _load_answers(submission):
+    # JSON object keys are strings
+    answers = json.loads(submission.answers)
+    return ({int(qid): text for qid, text in answers['text'].items()},
+            {int(qid): choice_ids for qid, choice_ids in answers['choice'].items()})
+
+
+def _write_batch(submissions, using):
+    '''
+    Creates an Answered_Survey per queued submission and writes all of
+    their answers at once
+    '''
+    survey_ids = dict(General_Survey.objects.using(using).filter(
+        id__in=set(s.general_survey_id for s in submissions)).values_list('id', 'survey_id'))
+    loaded = [_load_answers(s) for s in submissions]
+
+    # questions or choices may have been deleted since the response was queued
+    question_ids = set()
+    choice_ids = set()
+    for text_values, choice_values in loaded:
+        question_ids.update(text_values)
+        question_ids.update(choice_values)
+        for selected in choice_values.values():
+            choice_ids.update(selected)
+    question_ids = set(Question.objects.non_polymorphic().using(using).filter(
+        id__in=question_ids).values_list('id', flat=True))
+    choice_ids = set(Choice.objects.using(using).filter(id__in=choice_ids).values_list('id', flat=True))
+
+    answered_surveys = [Answered_Survey(survey_id=survey_ids[s.general_survey_id],
+                                        general_survey_id=s.general_survey_id,
+                                        responder_id=s.responder_id,
+                                        completed=True,
+                                        answered_on=timezone.localdate(s.received))
+                        for s in submissions]
+    features = connections[using].features
+    if getattr(features, 'can_return_ids_from_bulk_insert', False) or \
+            getattr(features, 'can_return_rows_from_bulk_insert', False):
+        Answered_Survey.objects.using(using).bulk_create(answered_surveys)
+    else:
+        for answered_survey in answered_surveys:
+            answered_survey.save(using=using)
+
+    answers = {}
+    for answered_survey, (text_values, choice_values) in zip(answered_surveys, loaded):
+        choices = {}
+        for qid, selected in choice_values.items():
+            selected = [c for c in selected if c in choice_ids]
+            # a question whose every picked choice is gone is left unanswered
+            if qid in question_ids and selected:
+                choices[qid] = selected
+        answers[answered_survey.pk] = (
+            dict((qid, text) for qid, text in text_values.items() if qid in question_ids), choices)
+    write_answers(answers, using)
+    record_statistics(Counter((a.survey_id, 0, 0) for a in answered_surveys), using)
+
+
+def _claim(queued, batch_size, using):
+    '''
+    Takes the next batch on backends without row locks, such as SQLite,
+    with an UPDATE first: it holds the database's write lock until the
+    batch commits, so a concurrent drainer waits and then finds the batch
+    gone
+    '''
+    token = uuid.uuid4().hex
+    Survey_Submission.objects.using(using).filter(
+        id__in=queued.values('id')[:batch_size]).update(claimed_by=token)
+    return list(queued.filter(claimed_by=token))
+
+
+def drain_submissions(batch_size=500):
+    '''
+    Writes out queued submissions, batch_size per transaction, until the
+    queue is empty. Several drainers can share the queue: they skip each
+    other's batches with SKIP LOCKED where the backend has it, wait for
+    them with SELECT ... FOR UPDATE otherwise, and claim them with an UPDATE
+    on backends without row locks. Returns the number of submissions
+    written.
+    '''
+    using = router.db_for_write(Survey_Submission)
+    features = connections[using].features
+    drained = 0
+
+    while True:
+        with transaction.atomic(using=using):
+            queued = Survey_Submission.objects.using(using).order_by('id')
+            if features.has_select_for_update_skip_locked:
+                submissions = list(queued.select_for_update(skip_locked=True)[:batch_size])
+            elif features.has_select_for_update:
+                submissions = list(queued.select_for_update()[:batch_size])
+            else:
+                submissions = _claim(queued, batch_size, using)
+            if not submissions:
+                break
+
+            _write_batch(submissions, using)
+            Survey_Submission.objects.using(using).filter(id__in=[s.id for s in submissions]).delete()
+            drained += len(submissions)
+
+    return drained
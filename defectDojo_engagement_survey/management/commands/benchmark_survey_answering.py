@@ -0,0 +1,224 @@
+'''
+Load generator for the survey answering pages.
+
+Start the same project once under WSGI and once under ASGI with a single
+worker, with SURVEY_ASYNC_VIEWS enabled for the latter, e.g.
+
+    gunicorn -w 1 --threads 8 dojo.wsgi
+    uvicorn --workers 1 dojo.asgi:application
+
+and point this command at each with the same survey URL:
+
+    python manage.py benchmark_survey_answering http://localhost:8000/empty_survey/1/answer \
+        --concurrency 200 --requests 5000 --submit --output wsgi.json
+
+Every respondent keeps its own session. With --submit each respondent
+loads the page, takes the CSRF token from it and posts a complete set of
+answers, built from the survey in this project's database, so run the
+command with the same settings as the server. With --username and
+--password every respondent logs in first, which answer_survey needs unless
+anonymous responses are enabled. Anonymous GETs of a general survey are
+served from the blank page cache; --no-page-cache logs in to measure the
+uncached page instead.
+
+GETs and POSTs are reported separately. The numbers to compare are the
+throughput and the latency percentiles at a given number of concurrent
+respondents.
+'''
+import json
+import re
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlparse
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+
+from defectDojo_engagement_survey.models import Answered_Survey, General_Survey
+from defectDojo_engagement_survey.schema import get_schema
+from defectDojo_engagement_survey.synthetic import answer_data
+
+CSRF_INPUT = re.compile(r'name=["\']csrfmiddlewaretoken["\'] value=["\']([^"\']+)["\']')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class NoRedirect(HTTPRedirectHandler):
+    # a redirect is the answer to a successful POST or a login, not a page to time
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Respondent(object):
+    '''
+    One simulated respondent with its own cookies
+    '''
+
+    def __init__(self, timeout):
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirect)
+        self.timeout = timeout
+
+    def request(self, url, data=None):
+        '''
+        Returns the status and body of a request, without following redirects
+        '''
+        headers = {'Referer': url}
+        if data is not None:
+            data = urlencode(data, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            with self.opener.open(Request(url, data, headers), timeout=self.timeout) as response:
+                return response.status, response.read().decode('utf-8', 'replace')
+        except HTTPError as e:
+            return e.code, ''
+
+    def csrf_token(self, page):
+        match = CSRF_INPUT.search(page)
+        if match:
+            return match.group(1)
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        return None
+
+    def login(self, login_url, username, password):
+        status, page = self.request(login_url)
+        status, page = self.request(login_url, {'username': username,
+                                                'password': password,
+                                                'csrfmiddlewaretoken': self.csrf_token(page)})
+        if status != 302:
+            raise CommandError('Logging in as %s at %s failed with status %s' % (username, login_url, status))
+
+
+class Results(object):
+    def __init__(self):
+        self.latencies = []
+        self.errors = []
+
+    def summary(self, duration):
+        return {'requests': len(self.latencies) + len(self.errors),
+                'errors': len(self.errors),
+                'first_error': self.errors[0] if self.errors else None,
+                'throughput': len(self.latencies) / duration if duration else None,
+                'p50': percentile(self.latencies, 0.50),
+                'p95': percentile(self.latencies, 0.95),
+                'p99': percentile(self.latencies, 0.99)}
+
+
+def survey_for(url):
+    '''
+    The Engagement_Survey answered at an answer page URL of this project
+    '''
+    try:
+        match = resolve(urlparse(url).path)
+    except Resolver404:
+        raise CommandError('%s is not a survey answer page of this project' % url)
+    if match.url_name == 'answer_survey':
+        return Answered_Survey.objects.select_related('survey').get(id=match.kwargs['sid']).survey
+    if match.url_name == 'answer_empty_survey':
+        return General_Survey.objects.select_related('survey').get(id=match.kwargs['esid']).survey
+    raise CommandError('%s is not a survey answer page' % url)
+
+
+class Command(BaseCommand):
+    help = 'Measures how many concurrent respondents a running server sustains on a survey page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Full URL of an answer_survey or answer_empty_survey page')
+        parser.add_argument('--concurrency', type=int, default=50, help='Simultaneous respondents')
+        parser.add_argument('--requests', type=int, default=1000, help='Total page loads')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request fails')
+        parser.add_argument('--submit', action='store_true',
+                            help='Post a complete set of answers after every page load')
+        parser.add_argument('--username', help='Log every respondent in as this user')
+        parser.add_argument('--password')
+        parser.add_argument('--login-url', help='Defaults to LOGIN_URL on the server of the survey URL')
+        parser.add_argument('--no-page-cache', action='store_true',
+                            help='Measure the uncached page, needs --username')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        url = options['url']
+        if options['no_page_cache'] and not options['username']:
+            raise CommandError('Anonymous GETs are served from the page cache, '
+                               '--no-page-cache needs --username to log in')
+        login_url = options['login_url'] or urljoin(url, str(settings.LOGIN_URL))
+        data = answer_data(get_schema(survey_for(url)).questions) if options['submit'] else None
+
+        remaining = [options['requests']]
+        lock = threading.Lock()
+        gets = Results()
+        posts = Results()
+
+        def timed(results, respondent, url, data, expected):
+            start = time.perf_counter()
+            try:
+                status, page = respondent.request(url, data)
+            except (URLError, OSError) as e:
+                status, page = str(e), ''
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == expected:
+                    results.latencies.append(elapsed)
+                else:
+                    results.errors.append('%s %s' % ('POST' if data else 'GET', status))
+            return status, page
+
+        def respondent_loop():
+            respondent = Respondent(options['timeout'])
+            if options['username']:
+                try:
+                    respondent.login(login_url, options['username'], options['password'])
+                except (CommandError, URLError, OSError) as e:
+                    with lock:
+                        gets.errors.append(str(e))
+                    return
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                status, page = timed(gets, respondent, url, None, 200)
+                if data is not None and status == 200:
+                    # a valid submission redirects, a re-rendered form means it was rejected
+                    timed(posts, respondent, url, dict(data, csrfmiddlewaretoken=respondent.csrf_token(page)), 302)
+
+        if options['username']:
+            # fail early on wrong credentials rather than once per respondent
+            Respondent(options['timeout']).login(login_url, options['username'], options['password'])
+
+        threads = [threading.Thread(target=respondent_loop) for i in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+        results = {
+            'url': url,
+            'concurrency': options['concurrency'],
+            'logged_in': bool(options['username']),
+            'duration': duration,
+            'get': gets.summary(duration),
+        }
+        if data is not None:
+            results['post'] = posts.summary(duration)
+
+        for method in ('get', 'post'):
+            if method in results:
+                for key, value in results[method].items():
+                    self.stdout.write('%-4s %-12s %s' % (method.upper(), key, value))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
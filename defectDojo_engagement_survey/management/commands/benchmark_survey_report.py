@@ -0,0 +1,89 @@
+'''
+Times a survey report end to end, loading included, on a database seeded
+with the synthetic data generator:
+
+    python manage.py benchmark_survey_report --answers 1000000 --compare
+
+seeds a survey of --questions questions answered across --engagements
+engagements until it holds about --answers answers, then times
+SurveyReport.load() and the three breakdowns. --survey reuses a survey
+seeded earlier instead. The seeded data stays for further runs,
+generate_survey_data --cleanup deletes it.
+'''
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from defectDojo_engagement_survey import reports
+from defectDojo_engagement_survey.models import Answer, Engagement_Survey
+from defectDojo_engagement_survey.synthetic import seed_answered_surveys, seed_engagements, seed_survey
+
+BREAKDOWNS = ('distribution', 'by_product', 'by_period')
+
+
+class Command(BaseCommand):
+    help = 'Times the survey report on a seeded database of synthetic answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=1000000, help='Answers to seed')
+        parser.add_argument('--questions', type=int, default=20, help='Questions of the seeded survey')
+        parser.add_argument('--choices', type=int, default=5, help='Most choices of a choice question')
+        parser.add_argument('--products', type=int, default=20)
+        parser.add_argument('--engagements', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500, help='Answered surveys per bulk insert')
+        parser.add_argument('--survey', type=int, help='Time the report of this survey instead of seeding one')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also time the pure Python fallback')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        survey = seed_survey(rng, options['questions'], options['choices'])
+        engagements = seed_engagements(rng, options['products'], options['engagements'])
+        answered = -(-options['answers'] // (options['questions'] * len(engagements)))
+        seed_answered_surveys(rng, survey, engagements, answered, options['batch_size'])
+        self.stdout.write('Seeded survey %d in %.1fs' % (survey.pk, time.perf_counter() - start))
+        return survey
+
+    def time_report(self, survey):
+        start = time.perf_counter()
+        report = reports.SurveyReport.load(survey)
+        timings = {'load': time.perf_counter() - start}
+        for name in BREAKDOWNS:
+            start = time.perf_counter()
+            getattr(report, name)()
+            timings[name] = time.perf_counter() - start
+        timings['total'] = sum(timings.values())
+        return timings
+
+    def handle(self, *args, **options):
+        if options['survey']:
+            survey = Engagement_Survey.objects.get(pk=options['survey'])
+        else:
+            survey = self.seed(options)
+
+        results = {'survey': survey.pk,
+                   'answers': Answer.objects.non_polymorphic().filter(answered_survey__survey=survey).count()}
+        self.stdout.write('Survey %d has %d answers' % (survey.pk, results['answers']))
+
+        engines = [('numpy' if reports.np is not None else 'python', reports.np)]
+        if options['compare'] and reports.np is not None:
+            engines.append(('python', None))
+
+        numpy = reports.np
+        try:
+            for engine, module in engines:
+                reports.np = module
+                results[engine] = self.time_report(survey)
+                for name, seconds in sorted(results[engine].items()):
+                    self.stdout.write('%-8s %-14s %.3fs' % (engine, name, seconds))
+        finally:
+            reports.np = numpy
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,163 @@
+'''
+Benchmarks the survey pages against seeded surveys of growing size.
+
+For every survey size it seeds a survey, an engagement and answered
+instances inside a transaction, requests each page through the test client
+as a staff user, and rolls everything back. Each result records the median
+latency and the number of queries, e.g.
+
+    python manage.py benchmark_survey_views --sizes 10,100,1000 --output run.json
+    python manage.py benchmark_survey_views --baseline run.json
+
+The second run fails when a page issues more queries than in the baseline
+or got slower by more than the tolerance. Either run fails when a page
+issues more queries than its SURVEY_QUERY_BUDGETS entry. Works on any backend, SQLite and
+PostgreSQL included; the numbers are only comparable on the same one.
+'''
+import json
+import random
+import statistics
+import time
+from datetime import datetime
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.template import Context, Template
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from defectDojo_engagement_survey.models import Answered_Survey
+from defectDojo_engagement_survey.queries import QueryRecorder, query_budget
+from defectDojo_engagement_survey.schema import get_schema, invalidate_schemas
+from defectDojo_engagement_survey.synthetic import answer_data, seed_answered_surveys, seed_engagement, seed_survey
+
+ENGAGEMENT_TAGS = Template('{% load survey_tags %}{% show_surveys engagement users %}{% add_surveys engagement %}')
+
+
+class Command(BaseCommand):
+    help = 'Measures latency and query counts of the survey pages at several survey sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000',
+                            help='Comma separated numbers of questions per survey')
+        parser.add_argument('--choices', type=int, default=200,
+                            help='Choices of the largest choice question')
+        parser.add_argument('--answered', type=int, default=1000,
+                            help='Answered instances per survey, up to 10000')
+        parser.add_argument('--max-answers', type=int, default=200000,
+                            help='Fewer answered instances for large surveys beyond this many answers')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per page')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare with the results of an earlier run')
+        parser.add_argument('--tolerance', type=float, default=1.25,
+                            help='Flag pages slower than the baseline by this factor')
+
+    def measure(self, connection, call, repeat):
+        # the first request fills the schema and template caches
+        call()
+        timings = []
+        for i in range(repeat):
+            with QueryRecorder(connection.alias) as queries:
+                start = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - start) * 1000)
+        repeated = queries.repeated()
+        return {'status': getattr(response, 'status_code', None),
+                'queries': queries.count,
+                'most_repeated': repeated[0][1] if repeated else 0,
+                'median_ms': round(statistics.median(timings), 2),
+                'min_ms': round(min(timings), 2),
+                'max_ms': round(max(timings), 2)}
+
+    def run_size(self, connection, client, rng, size, options):
+        answered = min(options['answered'], max(1, options['max_answers'] // size))
+        survey = seed_survey(rng, size, options['choices'])
+        engagement = seed_engagement(rng)
+        answered_ids = seed_answered_surveys(rng, survey, [engagement], answered,
+                                             batch_size=max(1, 50000 // size))
+        answered_survey = Answered_Survey.objects.get(pk=answered_ids[0])
+        data = answer_data(get_schema(survey).questions)
+
+        pages = [
+            ('answer_survey', 'GET', lambda: client.get(reverse('answer_survey', args=(engagement.id, answered_survey.id)))),
+            ('answer_survey', 'POST', lambda: client.post(reverse('answer_survey', args=(engagement.id, answered_survey.id)), data)),
+            ('view_survey', 'GET', lambda: client.get(reverse('view_survey', args=(engagement.id, answered_survey.id)))),
+            ('survey', 'GET', lambda: client.get(reverse('survey'))),
+            ('questions', 'GET', lambda: client.get(reverse('questions'))),
+            ('edit_survey_questions', 'GET', lambda: client.get(reverse('edit_survey_questions', args=(survey.id, )))),
+            ('delete_survey', 'GET', lambda: client.get(reverse('delete_survey', args=(survey.id, )))),
+            ('engagement_tags', 'RENDER', lambda: ENGAGEMENT_TAGS.render(Context({'engagement': engagement,
+                                                                                  'users': []}))),
+        ]
+
+        results = []
+        for view, method, call in pages:
+            result = dict(size=size, answered=answered, view=view, method=method,
+                          **self.measure(connection, call, options['repeat']))
+            self.stdout.write('%5d questions %-22s %-6s %4s queries (%3d repeated) %9.2f ms' % (
+                size, view, method, result['queries'], result['most_repeated'], result['median_ms']))
+            results.append(result)
+        return survey.id, results
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        using = router.db_for_write(Answered_Survey)
+        connection = connections[using]
+        rng = random.Random(options['seed'])
+        results = []
+        survey_ids = []
+
+        setup_test_environment()
+        try:
+            with transaction.atomic(using=using):
+                user = get_user_model().objects.create(username='survey-benchmark-%s' % rng.getrandbits(32),
+                                                       is_staff=True, is_superuser=True)
+                client = Client()
+                client.force_login(user)
+                for size in sizes:
+                    survey_id, size_results = self.run_size(connection, client, rng, size, options)
+                    survey_ids.append(survey_id)
+                    results.extend(size_results)
+                # nothing seeded is kept
+                transaction.set_rollback(True, using=using)
+        finally:
+            teardown_test_environment()
+            invalidate_schemas(survey_ids)
+
+        run = {'vendor': connection.vendor,
+               'django': django.get_version(),
+               'date': datetime.now().isoformat(),
+               'results': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(run, f, indent=2)
+
+        regressions = []
+        for result in results:
+            budget = query_budget(result['view'])
+            if budget is not None and result['queries'] > budget:
+                regressions.append('%(view)s %(method)s at %(size)d questions' % result +
+                                   ': %d queries, the budget is %d' % (result['queries'], budget))
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = dict(((r['size'], r['view'], r['method']), r) for r in json.load(f)['results'])
+            for result in results:
+                before = baseline.get((result['size'], result['view'], result['method']))
+                if before is None:
+                    continue
+                if result['queries'] > before['queries']:
+                    regressions.append('%(view)s %(method)s at %(size)d questions' % result +
+                                       ': %d queries, was %d' % (result['queries'], before['queries']))
+                if result['median_ms'] > before['median_ms'] * options['tolerance']:
+                    regressions.append('%(view)s %(method)s at %(size)d questions' % result +
+                                       ': %.2f ms, was %.2f' % (result['median_ms'], before['median_ms']))
+
+        if regressions:
+            raise CommandError('Regressions:\n%s' % '\n'.join(regressions))
+        if options['baseline']:
+            self.stdout.write('No regressions against %s.' % options['baseline'])
@@ -0,0 +1,79 @@
+'''
+Checks that the hot survey lookups are served by an index.
+
+Run it against a migrated PostgreSQL or SQLite database:
+
+    python manage.py check_survey_query_plans
+
+The test suite runs it on its test database, see tests/test_query_plans.py.
+
+It exits with an error when the plan of any lookup falls back to a
+sequential scan. On PostgreSQL sequential scans are disabled for the
+check, so a scan in the plan means no usable index exists at all rather
+than the planner preferring a scan on a small table.
+'''
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from defectDojo_engagement_survey.models import Answer, Answered_Survey, General_Survey
+
+
+def hot_lookups():
+    '''
+    The lookups every survey page relies on, as (description, queryset)
+    '''
+    return [
+        ('answer by survey and question',
+         Answer.objects.non_polymorphic().filter(answered_survey_id=1, question_id=1)),
+        ('answers of a survey',
+         Answer.objects.non_polymorphic().filter(answered_survey_id=1)),
+        ('answered surveys of an engagement',
+         Answered_Survey.objects.filter(engagement_id=1)),
+        ('answered surveys of a survey',
+         Answered_Survey.objects.filter(survey_id=1)),
+        ('answered survey by engagement and survey',
+         Answered_Survey.objects.filter(engagement_id=1, survey_id=1)),
+        ('expired general surveys',
+         General_Survey.objects.filter(expiration__lt=timezone.now())),
+    ]
+
+
+def is_sequential_scan(vendor, plan):
+    for line in plan.splitlines():
+        if vendor == 'postgresql' and 'Seq Scan' in line:
+            return True
+        # SQLite reports "SCAN TABLE t" or "SCAN t", and "USING INDEX" when it isn't a full scan
+        if vendor == 'sqlite' and ' SCAN ' in ' %s ' % line and 'USING' not in line:
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = 'Fails if a hot survey lookup is planned as a sequential scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        using = router.db_for_read(Answer)
+        vendor = connections[using].vendor
+        if vendor not in ('postgresql', 'sqlite'):
+            raise CommandError('Query plans can only be checked on PostgreSQL and SQLite, not %s' % vendor)
+
+        failures = []
+        with transaction.atomic(using=using):
+            if vendor == 'postgresql':
+                with connections[using].cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for description, queryset in hot_lookups():
+                plan = queryset.using(using).explain()
+                if options['verbose_plans']:
+                    self.stdout.write('%s:\n%s\n' % (description, plan))
+                if is_sequential_scan(vendor, plan):
+                    failures.append('%s:\n%s' % (description, plan))
+
+        if failures:
+            raise CommandError('Sequential scans found:\n\n' + '\n\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All %d survey lookups use an index.' % len(hot_lookups())))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from defectDojo_engagement_survey.intake import drain_submissions
+
+
+class Command(BaseCommand):
+    help = 'Writes out the general survey responses queued by the intake mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Submissions written per transaction')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep draining, sleeping this many seconds between runs')
+
+    def handle(self, *args, **options):
+        while True:
+            drained = drain_submissions(options['batch_size'])
+            self.stdout.write('Wrote %d queued submissions.' % drained)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,68 @@
+'''
+Fills the database with synthetic surveys and answers for load testing, e.g.
+
+    python manage.py generate_survey_data --seed 1 --surveys 10 --engagements 200 --answered 50
+    python manage.py generate_survey_data --cleanup
+
+The same seed builds the same data. Everything generated is marked, see
+synthetic.PREFIX, and --cleanup deletes it again.
+'''
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from defectDojo_engagement_survey.synthetic import cleanup, seed_answered_surveys, seed_engagements, \
+    seed_general_surveys, seed_question_bank, seed_survey
+
+
+class Command(BaseCommand):
+    help = 'Generates synthetic surveys, engagements and answers, or deletes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--questions', type=int, default=500, help='Questions in the question bank')
+        parser.add_argument('--choices', type=int, default=5, help='Most choices of a choice question')
+        parser.add_argument('--surveys', type=int, default=5)
+        parser.add_argument('--questions-per-survey', type=int, default=50)
+        parser.add_argument('--products', type=int, default=20)
+        parser.add_argument('--engagements', type=int, default=100)
+        parser.add_argument('--answered', type=int, default=10,
+                            help='Answered instances of every survey per engagement')
+        parser.add_argument('--general-surveys', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows or answered surveys per bulk insert')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete all generated data instead')
+
+    def step(self, message, call, *args, **kwargs):
+        start = time.perf_counter()
+        result = call(*args, **kwargs)
+        count = len(result) if isinstance(result, list) else result
+        self.stdout.write('%s in %.1f s' % (message % count, time.perf_counter() - start))
+        return result
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.step('Deleted the generated data, %d answers', cleanup, options['batch_size'])
+            return
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        bank = self.step('Created %d questions', lambda: seed_question_bank(
+            rng, options['questions'], options['choices'], batch_size=batch_size))
+        surveys = self.step('Created %d surveys', lambda: [
+            seed_survey(rng, options['questions_per_survey'], bank=bank) for i in range(options['surveys'])])
+        engagements = self.step('Created %d engagements', lambda: seed_engagements(
+            rng, options['products'], options['engagements']))
+
+        answered = 0
+        start = time.perf_counter()
+        for survey in surveys:
+            answered += len(seed_answered_surveys(rng, survey, engagements, options['answered'], batch_size))
+        self.stdout.write('Created %d answered surveys with their answers in %.1f s' % (
+            answered, time.perf_counter() - start))
+
+        if options['general_surveys'] and surveys:
+            self.step('Created %d general surveys', lambda: seed_general_surveys(
+                rng, surveys, options['general_surveys']))
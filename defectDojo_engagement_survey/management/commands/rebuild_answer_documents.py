@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from defectDojo_engagement_survey.answers import rebuild_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the JSON answers document of every answered survey from the answer tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Surveys rewritten per transaction')
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report documents that differ from the answer tables')
+
+    def handle(self, *args, **options):
+        changed = rebuild_documents(options['batch_size'], options['verify'])
+        if not options['verify']:
+            self.stdout.write('Rebuilt %d answers documents.' % changed)
+        elif changed:
+            raise CommandError('%d answers documents differ from the answer tables.' % changed)
+        else:
+            self.stdout.write('All answers documents match the answer tables.')
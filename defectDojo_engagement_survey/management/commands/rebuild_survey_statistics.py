@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from defectDojo_engagement_survey.statistics import rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the survey response statistics from the answer tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', type=int, action='append', dest='surveys',
+                            help='Only this survey id, may be repeated')
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report surveys whose statistics are wrong')
+
+    def handle(self, *args, **options):
+        wrong = rebuild_statistics(options['surveys'], options['verify'])
+        if not options['verify']:
+            self.stdout.write('Rebuilt the statistics of %d surveys.' % len(wrong))
+        elif wrong:
+            raise CommandError('Statistics differ for surveys %s.' % ', '.join(str(s) for s in wrong))
+        else:
+            self.stdout.write('All survey statistics match the answer tables.')
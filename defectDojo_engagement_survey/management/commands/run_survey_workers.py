@@ -0,0 +1,52 @@
+'''
+Runs the periodic survey jobs in one dedicated process:
+
+    python manage.py run_survey_workers
+
+sweeps expired general surveys every SURVEY_SWEEP_INTERVAL seconds and,
+with the intake queue enabled, writes out queued responses every
+SURVEY_INTAKE_INTERVAL seconds, until interrupted. Run a single instance;
+web workers and other commands never start these jobs.
+'''
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from defectDojo_engagement_survey.deletion import sweep_expired_general_surveys
+from defectDojo_engagement_survey.intake import drain_submissions, intake_enabled
+from defectDojo_engagement_survey.tasks import PeriodicTask
+
+
+class Command(BaseCommand):
+    help = 'Sweeps expired general surveys and drains the intake queue periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweep-interval', type=float,
+                            default=getattr(settings, 'SURVEY_SWEEP_INTERVAL', 60 * 60),
+                            help='Seconds between sweeps, 0 to not sweep')
+        parser.add_argument('--intake-interval', type=float,
+                            default=getattr(settings, 'SURVEY_INTAKE_INTERVAL', 5),
+                            help='Seconds between intake drains, 0 to not drain')
+
+    def handle(self, *args, **options):
+        tasks = []
+        if options['sweep_interval']:
+            tasks.append(PeriodicTask('survey-sweeper', options['sweep_interval'], sweep_expired_general_surveys))
+        if options['intake_interval'] and intake_enabled():
+            tasks.append(PeriodicTask('survey-intake', options['intake_interval'], drain_submissions))
+        if not tasks:
+            raise CommandError('Nothing to run')
+
+        for task in tasks:
+            task.start()
+            self.stdout.write('Started %s every %s seconds.' % (task.name, task.interval))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for task in tasks:
+                task.stop()
+            for task in tasks:
+                task.join()
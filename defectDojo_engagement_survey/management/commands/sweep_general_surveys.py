@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from defectDojo_engagement_survey.deletion import sweep_expired_general_surveys
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired general surveys and their anonymous responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows deleted per transaction')
+
+    def handle(self, *args, **options):
+        deleted = sweep_expired_general_surveys(options['chunk_size'])
+        self.stdout.write('Deleted %d expired general surveys.' % deleted)
@@ -0,0 +1,156 @@
+'''
+Operational metrics of the survey plugin in the Prometheus text format.
+
+Counters and histograms live in the memory of each process and are served
+to staff at /survey/metrics. Nothing is recorded unless SURVEY_METRICS is
+on, a disabled metric costs one settings lookup per call. With several
+worker processes every scrape sees the process that served it, so scrape
+each worker or run a single one behind the metrics URL.
+'''
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def metrics_enabled():
+    return getattr(settings, 'SURVEY_METRICS', False)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format(value):
+    return repr(float(value)) if value != int(value) else '%d' % value
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, **kwargs):
+        if not metrics_enabled():
+            return
+        labels = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + kwargs.get('amount', 1)
+
+    def _render_value(self, labels, value):
+        return ['%s%s %s' % (self.name, self._label_text(labels), _format(value))]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not metrics_enabled():
+            return
+        labels = tuple(str(label) for label in labels)
+        # per bucket counts, the last one past every bound, then the sum
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def _render_value(self, labels, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else _format(bound)
+            lines.append('%s_bucket%s %d' % (self.name, self._label_text(labels, [('le', le)]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, self._label_text(labels), _format(counts[-1])))
+        lines.append('%s_count%s %d' % (self.name, self._label_text(labels), cumulative))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        '''
+        Every metric in the Prometheus text exposition format
+        '''
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+VIEW_SECONDS = REGISTRY.histogram(
+    'survey_view_duration_seconds', 'Time to serve a survey view', ('view', 'method'))
+VIEW_EXCEPTIONS = REGISTRY.counter(
+    'survey_view_exceptions_total', 'Survey views that raised an exception', ('view', ))
+FORM_BUILD_SECONDS = REGISTRY.histogram(
+    'survey_form_build_seconds', 'Time to build the form of one question, averaged over a page')
+ANSWER_SAVE_SECONDS = REGISTRY.histogram(
+    'survey_answer_save_seconds', 'Time to save one answer, averaged over a submission')
+SUBMISSION_ANSWERS = REGISTRY.histogram(
+    'survey_submission_answers', 'Answers per submitted survey', buckets=SIZE_BUCKETS)
+SUBMISSIONS = REGISTRY.counter(
+    'survey_submissions_total', 'Submitted surveys by outcome: completed, queued or invalid', ('outcome', ))
+GENERAL_RESPONSES = REGISTRY.counter(
+    'survey_general_responses_total', 'Accepted responses to each general survey', ('general_survey', ))
+CACHE_LOOKUPS = REGISTRY.counter(
+    'survey_cache_lookups_total', 'Lookups of the survey caches by result', ('cache', 'result'))
+
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache, 'hit' if hit else 'miss')
@@ -0,0 +1,78 @@
+'''
+Middleware for the survey views, add them to MIDDLEWARE to use them.
+'''
+import logging
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import VIEW_EXCEPTIONS, VIEW_SECONDS, metrics_enabled
+from .queries import QueryRecorder, query_budget, query_budget_enabled
+
+logger = logging.getLogger('defectDojo_engagement_survey.queries')
+
+
+def is_survey_view(view_func):
+    return getattr(view_func, '__module__', '').startswith('defectDojo_engagement_survey.')
+
+
+class QueryBudgetMiddleware(object):
+    '''
+    Counts the queries of every survey view, adds them to the response as
+    an X-Survey-Queries header, logs them, and warns when a view goes over
+    its SURVEY_QUERY_BUDGETS entry. Only active with SURVEY_QUERY_BUDGET,
+    which defaults to DEBUG.
+    '''
+
+    def __init__(self, get_response):
+        if not query_budget_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        recorder = getattr(request, '_survey_queries', None)
+        if recorder is None:
+            return response
+        recorder.__exit__(None, None, None)
+
+        view_name = request.resolver_match.url_name if request.resolver_match else None
+        summary = recorder.summary(view_name)
+        response['X-Survey-Queries'] = summary
+        logger.debug('%s %s', request.path, summary)
+        problems = recorder.over_budget(query_budget(view_name))
+        if problems:
+            logger.warning('%s over its query budget, %s; most repeated: %s', view_name, problems[0],
+                           '; '.join('%dx %s' % (n, sql) for sql, n in recorder.repeated()[:3]))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if is_survey_view(view_func):
+            request._survey_queries = QueryRecorder().__enter__()
+
+
+class MetricsMiddleware(object):
+    '''
+    Times every survey view for the survey_view_duration_seconds histogram
+    and counts the ones that raise. Only active with SURVEY_METRICS.
+    '''
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        start = getattr(request, '_survey_view_start', None)
+        if start is not None:
+            VIEW_SECONDS.observe(time.perf_counter() - start, request.resolver_match.url_name, request.method)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if is_survey_view(view_func):
+            request._survey_view_start = time.perf_counter()
+
+    def process_exception(self, request, exception):
+        if hasattr(request, '_survey_view_start'):
+            VIEW_EXCEPTIONS.inc(request.resolver_match.url_name)
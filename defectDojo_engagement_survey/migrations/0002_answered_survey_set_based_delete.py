@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='answered_survey',
+            name='engagement',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='engagement+', to='dojo.Engagement'),
+        ),
+        migrations.AlterField(
+            model_name='answered_survey',
+            name='survey',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='defectDojo_engagement_survey.Engagement_Survey'),
+        ),
+    ]
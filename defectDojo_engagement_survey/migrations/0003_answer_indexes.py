@@ -0,0 +1,52 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_answers(apps, schema_editor):
+    '''
+    Keeps the latest answer of every (answered_survey, question) pair so the
+    unique constraint can be added.
+    '''
+    Answer = apps.get_model('defectDojo_engagement_survey', 'Answer')
+    TextAnswer = apps.get_model('defectDojo_engagement_survey', 'TextAnswer')
+    ChoiceAnswer = apps.get_model('defectDojo_engagement_survey', 'ChoiceAnswer')
+    db_alias = schema_editor.connection.alias
+
+    duplicates = Answer.objects.using(db_alias).values('answered_survey', 'question').annotate(
+        n=Count('id'), keep=Max('id')).filter(n__gt=1)
+    for duplicate in duplicates:
+        ids = list(Answer.objects.using(db_alias).filter(
+            answered_survey=duplicate['answered_survey'],
+            question=duplicate['question'],
+        ).exclude(id=duplicate['keep']).values_list('id', flat=True))
+        ChoiceAnswer.answer.through.objects.using(db_alias).filter(choiceanswer_id__in=ids).delete()
+        TextAnswer.objects.using(db_alias).filter(answer_ptr_id__in=ids)._raw_delete(db_alias)
+        ChoiceAnswer.objects.using(db_alias).filter(answer_ptr_id__in=ids)._raw_delete(db_alias)
+        Answer.objects.using(db_alias).filter(id__in=ids)._raw_delete(db_alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0002_answered_survey_set_based_delete'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_answers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(fields=('answered_survey', 'question'), name='survey_answer_unique_question'),
+        ),
+        migrations.AddIndex(
+            model_name='answered_survey',
+            index=models.Index(fields=['engagement', 'survey'], name='survey_answered_eng_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answered_survey',
+            index=models.Index(fields=['survey', 'completed'], name='survey_answered_srv_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='general_survey',
+            index=models.Index(fields=['expiration'], name='survey_general_exp_idx'),
+        ),
+    ]
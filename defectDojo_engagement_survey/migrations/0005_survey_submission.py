@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('defectDojo_engagement_survey', '0004_answered_survey_general_survey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Survey_Submission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answers', models.TextField()),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('general_survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='defectDojo_engagement_survey.General_Survey')),
+                ('responder', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Queued Survey Submission',
+                'verbose_name_plural': 'Queued Survey Submissions',
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+import json
+
+from django.db import migrations, models
+
+
+def build_answer_documents(apps, schema_editor):
+    '''
+    Fills the answers document of every answered survey from the answer
+    tables, a thousand surveys at a time
+    '''
+    Answered_Survey = apps.get_model('defectDojo_engagement_survey', 'Answered_Survey')
+    TextAnswer = apps.get_model('defectDojo_engagement_survey', 'TextAnswer')
+    ChoiceAnswer = apps.get_model('defectDojo_engagement_survey', 'ChoiceAnswer')
+    db_alias = schema_editor.connection.alias
+
+    ids = list(Answered_Survey.objects.using(db_alias).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(ids), 1000):
+        batch = ids[start:start + 1000]
+        documents = dict((survey_id, {}) for survey_id in batch)
+
+        texts = TextAnswer.objects.using(db_alias).filter(
+            answered_survey_id__in=batch).values_list('answered_survey_id', 'question_id', 'answer')
+        for survey_id, question_id, text in texts:
+            documents[survey_id][str(question_id)] = text
+
+        selected = ChoiceAnswer.answer.through.objects.using(db_alias).filter(
+            choiceanswer__answered_survey_id__in=batch
+        ).order_by('choice__order').values_list(
+            'choiceanswer__answered_survey_id', 'choiceanswer__question_id', 'choice_id')
+        for survey_id, question_id, choice_id in selected:
+            documents[survey_id].setdefault(str(question_id), []).append(choice_id)
+
+        Answered_Survey.objects.using(db_alias).bulk_update(
+            [Answered_Survey(id=survey_id,
+                             answers_document=json.dumps(document, separators=(',', ':'), sort_keys=True))
+             for survey_id, document in documents.items()],
+            ['answers_document'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0005_survey_submission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answered_survey',
+            name='answers_document',
+            field=models.TextField(blank=True, default='{}', editable=False, null=True),
+        ),
+        migrations.RunPython(build_answer_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def fill_selected(apps, schema_editor):
+    '''
+    Copies the choice selections of existing answers into their compact
+    form, a thousand answers at a time
+    '''
+    ChoiceAnswer = apps.get_model('defectDojo_engagement_survey', 'ChoiceAnswer')
+    db_alias = schema_editor.connection.alias
+
+    ids = list(ChoiceAnswer.objects.using(db_alias).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), 1000):
+        batch = ids[start:start + 1000]
+        selected = dict((answer_id, []) for answer_id in batch)
+        rows = ChoiceAnswer.answer.through.objects.using(db_alias).filter(
+            choiceanswer_id__in=batch).values_list('choiceanswer_id', 'choice_id')
+        for answer_id, choice_id in rows:
+            selected[answer_id].append(choice_id)
+
+        ChoiceAnswer.objects.using(db_alias).bulk_update(
+            [ChoiceAnswer(pk=answer_id, selected=','.join(str(c) for c in sorted(set(choice_ids))))
+             for answer_id, choice_ids in selected.items()],
+            ['selected'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0006_answered_survey_answers_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choiceanswer',
+            name='selected',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_selected, migrations.RunPython.noop),
+    ]
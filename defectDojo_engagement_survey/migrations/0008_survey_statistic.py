@@ -0,0 +1,63 @@
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def build_statistics(apps, schema_editor):
+    '''
+    Counts the completed responses, answers and choice picks given so far
+    '''
+    Answered_Survey = apps.get_model('defectDojo_engagement_survey', 'Answered_Survey')
+    Answer = apps.get_model('defectDojo_engagement_survey', 'Answer')
+    Survey_Statistic = apps.get_model('defectDojo_engagement_survey', 'Survey_Statistic')
+    db_alias = schema_editor.connection.alias
+
+    counts = Counter()
+    completed = Answered_Survey.objects.using(db_alias).filter(
+        completed=True).order_by().values('survey_id').annotate(n=Count('id'))
+    for row in completed:
+        counts[(row['survey_id'], 0, 0)] += row['n']
+
+    answers = Answer.objects.using(db_alias).values_list(
+        'answered_survey__survey_id', 'question_id', 'choiceanswer__selected')
+    for survey_id, question_id, selected in answers.iterator():
+        counts[(survey_id, question_id, 0)] += 1
+        for choice_id in (selected or '').split(','):
+            if choice_id:
+                counts[(survey_id, question_id, int(choice_id))] += 1
+
+    Survey_Statistic.objects.using(db_alias).bulk_create(
+        [Survey_Statistic(survey_id=survey_id, question_id=question_id, choice_id=choice_id, total=total)
+         for (survey_id, question_id, choice_id), total in counts.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0007_choiceanswer_selected'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Survey_Statistic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_id', models.PositiveIntegerField(default=0)),
+                ('choice_id', models.PositiveIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='defectDojo_engagement_survey.Engagement_Survey')),
+            ],
+            options={
+                'verbose_name': 'Survey Statistic',
+                'verbose_name_plural': 'Survey Statistics',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='survey_statistic',
+            constraint=models.UniqueConstraint(fields=('survey', 'question_id', 'choice_id'), name='survey_statistic_unique'),
+        ),
+        migrations.RunPython(build_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0008_survey_statistic'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='answered_survey',
+            name='general_survey',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='defectDojo_engagement_survey.General_Survey'),
+        ),
+    ]
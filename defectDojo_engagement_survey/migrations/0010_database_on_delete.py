@@ -0,0 +1,72 @@
+'''
+Lets the database itself remove answered surveys and their answers when
+their engagement or survey goes, and unlink the responses of a deleted
+general survey.
+
+Django leaves these relations to the handlers in signals.py, which delete
+with a few set based statements. The ON DELETE actions make a delete that
+bypasses them, such as raw SQL or QuerySet._raw_delete(), end the same way.
+Only PostgreSQL and MySQL are altered; SQLite can't change a foreign key in
+place, and there such a delete fails the foreign key check instead.
+'''
+from django.db import migrations
+
+APP = 'defectDojo_engagement_survey'
+
+# model, foreign key and its ON DELETE action
+ON_DELETE = [
+    ('Answered_Survey', 'engagement', 'CASCADE'),
+    ('Answered_Survey', 'survey', 'CASCADE'),
+    ('Answered_Survey', 'general_survey', 'SET NULL'),
+    ('Answer', 'answered_survey', 'CASCADE'),
+    ('TextAnswer', 'answer_ptr', 'CASCADE'),
+    ('ChoiceAnswer', 'answer_ptr', 'CASCADE'),
+]
+
+
+def foreign_keys(apps):
+    for model_name, field_name, action in ON_DELETE:
+        model = apps.get_model(APP, model_name)
+        yield model, model._meta.get_field(field_name), action
+    # the selected choices of a choice answer
+    through = apps.get_model(APP, 'ChoiceAnswer')._meta.get_field('answer').remote_field.through
+    yield through, through._meta.get_field('choiceanswer'), 'CASCADE'
+
+
+def set_on_delete(schema_editor, model, field, action):
+    '''
+    Recreates the foreign key constraint of field with an ON DELETE action,
+    or without one when action is None
+    '''
+    quote = schema_editor.quote_name
+    table = quote(model._meta.db_table)
+    for name in schema_editor._constraint_names(model, [field.column], foreign_key=True):
+        schema_editor.execute(schema_editor.sql_delete_fk % {'table': table, 'name': quote(name)})
+        schema_editor.execute('ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (%s)%s%s' % (
+            table, quote(name), quote(field.column),
+            quote(field.target_field.model._meta.db_table), quote(field.target_field.column),
+            ' ON DELETE %s' % action if action else '',
+            schema_editor.connection.ops.deferrable_sql()))
+
+
+def add_on_delete(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'mysql'):
+        for model, field, action in foreign_keys(apps):
+            set_on_delete(schema_editor, model, field, action)
+
+
+def remove_on_delete(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'mysql'):
+        for model, field, action in foreign_keys(apps):
+            set_on_delete(schema_editor, model, field, None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0009_answered_survey_general_survey_do_nothing'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_on_delete, remove_on_delete),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defectDojo_engagement_survey', '0010_database_on_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey_submission',
+            name='claimed_by',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+    ]
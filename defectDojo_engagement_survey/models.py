@@ -5,6 +5,7 @@ Created on Feb 16, 2015
 '''
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.utils import timezone
 from django_extensions.db.models import TimeStampedModel
 from polymorphic.models import PolymorphicModel
 from auditlog.registry import auditlog
@@ -91,6 +92,15 @@ class ChoiceQuestion(Question):
 
 
 # meant to be a abstract survey, identified by name for purpose
+class Engagement_SurveyQuerySet(models.QuerySet):
+    def available_for(self, engagement):
+        '''
+        Surveys not yet added to an engagement, with a NOT EXISTS subquery
+        '''
+        added = Answered_Survey.objects.filter(engagement=engagement, survey=models.OuterRef('pk'))
+        return self.annotate(added=models.Exists(added)).filter(added=False)
+
+
 class Engagement_Survey(models.Model):
     name = models.CharField(max_length=200, null=False, blank=False,
                             editable=True, default='')
@@ -98,6 +108,8 @@ class Engagement_Survey(models.Model):
     questions = models.ManyToManyField(Question)
     active = models.BooleanField(default=True)
 
+    objects = Engagement_SurveyQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Engagement Survey"
         verbose_name_plural = "Engagement Surveys"
@@ -114,11 +126,14 @@ class Engagement_Survey(models.Model):
 
 class Answered_Survey(models.Model):
     # tie this to a specific engagement
+    # answered surveys are removed by deletion.py when the engagement or the
+    # survey goes, see signals.py, rather than by Django's collector; the
+    # database cascades too where migration 0010 could add ON DELETE
     engagement = models.ForeignKey(Engagement, related_name='engagement+',
                                    null=True, blank=False, editable=True,
-                                   on_delete=models.CASCADE)
+                                   on_delete=models.DO_NOTHING)
     # what surveys have been answered
-    survey = models.ForeignKey(Engagement_Survey, on_delete=models.CASCADE)
+    survey = models.ForeignKey(Engagement_Survey, on_delete=models.DO_NOTHING)
     assignee = models.ForeignKey(User, related_name='assignee',
                                   null=True, blank=True, editable=True,
                                   default=None, on_delete=models.CASCADE)
@@ -128,10 +143,20 @@ class Answered_Survey(models.Model):
                                   default=None, on_delete=models.CASCADE)
     completed = models.BooleanField(default=False)
     answered_on = models.DateField(null=True)
+    # the general survey an anonymous response was given to; unlinked by
+    # deletion.py when the general survey goes, see signals.py
+    general_survey = models.ForeignKey('General_Survey', null=True, blank=True,
+                                       editable=False, on_delete=models.DO_NOTHING)
+    # JSON copy of the answers, see answers.py; NULL when it isn't kept up to date
+    answers_document = models.TextField(null=True, blank=True, editable=False, default='{}')
 
     class Meta:
         verbose_name = "Answered Engagement Survey"
         verbose_name_plural = "Answered Engagement Surveys"
+        indexes = [
+            models.Index(fields=['engagement', 'survey'], name='survey_answered_eng_idx'),
+            models.Index(fields=['survey', 'completed'], name='survey_answered_srv_idx'),
+        ]
 
     def __unicode__(self):
         return self.survey.name
@@ -139,16 +164,62 @@ class Answered_Survey(models.Model):
     def __str__(self):
         return self.survey.name
 
+    def save(self, *args, **kwargs):
+        # the answers document is only written by answers.write_answers, a
+        # copy loaded earlier must not overwrite it
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'answers_document']
+        super(Answered_Survey, self).save(*args, **kwargs)
+
+
+def available_surveys(engagement):
+    '''
+    Returns the list of surveys that can still be added to an engagement,
+    loaded once per engagement instance so the engagement page, its add
+    survey tag and the add survey form share one query. Call
+    forget_available_surveys() after adding a survey.
+    '''
+    if not hasattr(engagement, '_available_surveys'):
+        engagement._available_surveys = list(Engagement_Survey.objects.available_for(engagement))
+    return engagement._available_surveys
+
+
+def forget_available_surveys(engagement):
+    engagement.__dict__.pop('_available_surveys', None)
+
+
+class General_SurveyQuerySet(models.QuerySet):
+    def open(self):
+        '''
+        General surveys that haven't expired, whether or not they were swept
+        '''
+        return self.filter(expiration__gt=timezone.now())
+
+    def with_response_counts(self):
+        '''
+        Annotates every general survey with its response_count() in the same
+        query
+        '''
+        return self.annotate(responses=models.F('num_responses') + models.Count('answered_survey'))
+
 
 class General_Survey(models.Model):
     survey = models.ForeignKey(Engagement_Survey, on_delete=models.CASCADE)
+    # responses counted before they were linked through
+    # Answered_Survey.general_survey, see response_count()
     num_responses = models.IntegerField(default=0)
     generated = models.DateTimeField(auto_now_add=True, null=True)
     expiration = models.DateTimeField(null=False, blank=False)
 
+    objects = General_SurveyQuerySet.as_manager()
+
     class Meta:
         verbose_name = "General Engagement Survey"
         verbose_name_plural = "General Engagement Surveys"
+        indexes = [
+            models.Index(fields=['expiration'], name='survey_general_exp_idx'),
+        ]
 
     def __unicode__(self):
         return self.survey.name
@@ -156,6 +227,58 @@ class General_Survey(models.Model):
     def __str__(self):
         return self.survey.name
 
+    def response_count(self):
+        '''
+        Number of responses, counted from the linked answered surveys so
+        that respondents never write to the general survey row. Only
+        responses that still exist are counted: deleting one, or the
+        engagement it was linked to, lowers the count. Uses the count of
+        General_Survey.objects.with_response_counts() when loaded through it.
+        '''
+        if hasattr(self, 'responses'):
+            return self.responses
+        return self.num_responses + self.answered_survey_set.count()
+
+
+class Survey_Submission(models.Model):
+    '''
+    A validated response to a general survey, queued by intake.py until the
+    intake worker writes it out
+    '''
+    general_survey = models.ForeignKey(General_Survey, on_delete=models.CASCADE)
+    responder = models.ForeignKey(User, null=True, blank=True, default=None,
+                                  on_delete=models.CASCADE)
+    # JSON, see intake.enqueue_submission
+    answers = models.TextField()
+    received = models.DateTimeField(auto_now_add=True)
+    # the drainer writing it out, on backends without row locks, see
+    # intake.drain_submissions
+    claimed_by = models.CharField(max_length=32, null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = "Queued Survey Submission"
+        verbose_name_plural = "Queued Survey Submissions"
+
+
+class Survey_Statistic(models.Model):
+    '''
+    A running count kept by statistics.py: completed responses of a survey
+    when question_id and choice_id are 0, answers to a question when only
+    choice_id is 0, picks of a choice otherwise
+    '''
+    survey = models.ForeignKey(Engagement_Survey, on_delete=models.CASCADE)
+    question_id = models.PositiveIntegerField(default=0)
+    choice_id = models.PositiveIntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Survey Statistic"
+        verbose_name_plural = "Survey Statistics"
+        constraints = [
+            models.UniqueConstraint(fields=['survey', 'question_id', 'choice_id'],
+                                    name='survey_statistic_unique'),
+        ]
+
 
 class Answer(PolymorphicModel, TimeStampedModel):
     ''' Base Answer model
@@ -170,6 +293,14 @@ class Answer(PolymorphicModel, TimeStampedModel):
                                         blank=False,
                                         on_delete=models.CASCADE)
 
+    class Meta(PolymorphicModel.Meta):
+        # one answer per question and survey, also serves the
+        # (answered_survey, question) lookups
+        constraints = [
+            models.UniqueConstraint(fields=['answered_survey', 'question'],
+                                    name='survey_answer_unique_question'),
+        ]
+
 
 class TextAnswer(Answer):
     answer = models.TextField(
@@ -185,6 +316,8 @@ class ChoiceAnswer(Answer):
     answer = models.ManyToManyField(
         Choice,
         help_text='The selected choices as the answer')
+    # the same selection as sorted comma separated choice ids, see answers.encode_selection
+    selected = models.TextField(blank=True, editable=False, default='')
 
     def __unicode__(self):
         if len(self.answer.all()):
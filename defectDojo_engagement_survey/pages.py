@@ -0,0 +1,97 @@
+'''
+Page cache for the blank form of a General_Survey.
+
+Every anonymous respondent of a general survey gets the same blank form, so
+it is rendered once with a placeholder where the CSRF token goes and served
+from the cache afterwards with the respondent's own token swapped in. An
+entry is dropped when its survey schema version changes, when the general
+survey expires, is edited or deleted, or when the system settings change.
+'''
+import uuid
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http.response import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+
+from .metrics import cache_lookup
+from .schema import schema_version
+
+CSRF_PLACEHOLDER = 'survey-csrf-token-placeholder'
+
+PAGE_KEY = 'survey_blank_page:%s'
+GENERATION_KEY = 'survey_blank_page_generation'
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.add(GENERATION_KEY, generation, None)
+        generation = cache.get(GENERATION_KEY) or generation
+    return generation
+
+
+def is_cacheable(request):
+    '''
+    Only anonymous GETs without pending messages see the shared blank page
+    '''
+    return request.method == 'GET' and \
+        request.user.is_anonymous and \
+        not len(messages.get_messages(request))
+
+
+def get_blank_page(request, general_survey_id):
+    '''
+    Returns the cached blank page of a general survey, or None on a miss.
+    A hit only talks to the cache backend.
+    '''
+    if not is_cacheable(request):
+        return None
+
+    entry = cache.get(PAGE_KEY % general_survey_id)
+    if entry is None:
+        cache_lookup('blank_page', False)
+        return None
+
+    survey_id, version, generation, expiration, content = entry
+    if expiration <= timezone.now() or \
+            version != schema_version(survey_id) or \
+            generation != _generation():
+        cache_lookup('blank_page', False)
+        return None
+
+    cache_lookup('blank_page', True)
+    return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+def set_blank_page(request, general_survey, response):
+    '''
+    Stores a rendered blank page and returns it with the real CSRF token
+    '''
+    content = response.content.decode(response.charset)
+    timeout = (general_survey.expiration - timezone.now()).total_seconds()
+    timeout = int(min(timeout, getattr(settings, 'SURVEY_PAGE_CACHE_TIMEOUT', 60 * 60)))
+    if timeout > 0:
+        cache.set(PAGE_KEY % general_survey.id,
+                  (general_survey.survey_id,
+                   schema_version(general_survey.survey_id),
+                   _generation(),
+                   general_survey.expiration,
+                   content),
+                  timeout)
+
+    return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)))
+
+
+def invalidate_blank_page(general_survey_id):
+    cache.delete(PAGE_KEY % general_survey_id)
+
+
+def invalidate_blank_pages():
+    '''
+    Drops every cached blank page, e.g. when system settings change
+    '''
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
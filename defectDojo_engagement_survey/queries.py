@@ -0,0 +1,130 @@
+'''
+Query counting for the survey views.
+
+QueryRecorder hooks into every database connection with
+connection.execute_wrapper() and records each statement with its duration,
+whether DEBUG is on or not. Statements are grouped by fingerprint, the SQL
+with its literals and IN lists folded, so a lookup repeated once per
+question or per choice, the N+1 signature, shows up as one fingerprint
+with a high count.
+
+QueryBudgetMiddleware, see middleware.py, reports what each survey view
+issued, and assert_query_budget() turns the same numbers into assertions:
+
+    with assert_query_budget(15, max_repeats=1):
+        client.get(reverse('view_survey', args=(engagement.id, answered.id)))
+'''
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+\b')
+_IN_LIST = re.compile(r'IN \((?:(?:%s|\?), )*(?:%s|\?)\)')
+
+
+def fingerprint(sql):
+    '''
+    The shape of a statement: string and number literals become ? and IN
+    lists of any length become IN (...)
+    '''
+    sql = _NUMBER.sub('?', _STRING.sub('?', sql))
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+def query_budget_enabled():
+    return getattr(settings, 'SURVEY_QUERY_BUDGET', settings.DEBUG)
+
+
+def query_budget(view_name):
+    '''
+    The most queries a view may issue, from SURVEY_QUERY_BUDGETS, or None
+    '''
+    return getattr(settings, 'SURVEY_QUERY_BUDGETS', {}).get(view_name)
+
+
+class QueryRecorder(object):
+    '''
+    Records the statements run on the given connection aliases, or on all of
+    them, while it is entered. Only statements run by the current thread are
+    seen.
+    '''
+
+    def __init__(self, using=None):
+        self.aliases = [using] if using else list(settings.DATABASES)
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in self.aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time_ms(self):
+        return sum(duration for sql, duration in self.queries) * 1000
+
+    def repeated(self):
+        '''
+        Fingerprints issued more than once, most repeated first, as
+        (fingerprint, count)
+        '''
+        counts = Counter(fingerprint(sql) for sql, duration in self.queries)
+        return [(sql, n) for sql, n in counts.most_common() if n > 1]
+
+    def summary(self, view_name=None):
+        '''
+        One line for a response header or a log message
+        '''
+        repeated = self.repeated()
+        return 'view=%s; queries=%d; time=%.1fms; repeated=%d; most-repeated=%d' % (
+            view_name or '-', self.count, self.time_ms, len(repeated), repeated[0][1] if repeated else 0)
+
+    def over_budget(self, max_queries=None, max_repeats=None):
+        '''
+        Describes every way the recorded queries exceed a budget: more than
+        max_queries statements, or any fingerprint issued more than
+        max_repeats times. Returns an empty list within budget.
+        '''
+        problems = []
+        if max_queries is not None and self.count > max_queries:
+            problems.append('%d queries, the budget is %d' % (self.count, max_queries))
+        if max_repeats is not None:
+            problems.extend('%d times, at most %d allowed: %s' % (n, max_repeats, sql)
+                            for sql, n in self.repeated() if n > max_repeats)
+        return problems
+
+
+@contextmanager
+def assert_query_budget(max_queries=None, max_repeats=None, using=None):
+    '''
+    Fails with an AssertionError when the block issues more than max_queries
+    queries, or repeats any statement more than max_repeats times. A view
+    name as max_queries takes its budget from SURVEY_QUERY_BUDGETS.
+    '''
+    if isinstance(max_queries, str):
+        max_queries = query_budget(max_queries)
+    with QueryRecorder(using) as recorder:
+        yield recorder
+    problems = recorder.over_budget(max_queries, max_repeats)
+    if problems:
+        raise AssertionError('Query budget exceeded:\n' + '\n'.join(problems))
@@ -0,0 +1,223 @@
+'''
+Cross-engagement reports of an Engagement_Survey.
+
+The answers of a survey, optionally limited to some products, a date range
+or completed responses, are counted by the database with two GROUP BY
+queries into columns: one row per (product, month, question) with its
+number of answers, from the answer table, and one row per (product, month,
+question, choice) with its number of picks, from the selected choices.
+Python never sees a row per answer. Distributions, per product comparisons
+and monthly trends are then weighted group-by counts over those columns,
+done with NumPy when it is installed (pip install
+defectDojo_engagement_survey[reports]) and with a Counter otherwise.
+'''
+import csv
+from collections import Counter, namedtuple
+
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+from dojo.models import Product
+
+from .models import Answer, ChoiceAnswer
+from .schema import CHOICE, get_schema
+from .tallies import offered_choices
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+ANSWER_COLUMNS = ('product', 'period', 'question', 'count')
+PICK_COLUMNS = ('product', 'period', 'question', 'choice', 'count')
+
+
+class AnswerColumns(namedtuple('AnswerColumns', ['answers', 'picks'])):
+    '''
+    Two tables of equal length integer columns, keyed by column name, whose
+    count column says how many answers or picks a row stands for. A
+    product of 0 is a general survey response without an engagement, a
+    period of 0 an unknown answer date, periods are YYYYMM otherwise.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_rows(cls, answers, picks):
+        '''
+        Builds the columns from (product, period, question, count) answer
+        rows and (product, period, question, choice, count) pick rows
+        '''
+        return cls(_table(ANSWER_COLUMNS, answers), _table(PICK_COLUMNS, picks))
+
+
+def _table(names, rows):
+    columns = list(zip(*rows)) or [()] * len(names)
+    return dict((name, _column(values)) for name, values in zip(names, columns))
+
+
+def _column(values):
+    if np is not None:
+        return np.asarray(values, dtype=np.int64)
+    return list(values)
+
+
+def count_by(table, keys):
+    '''
+    Returns the summed count column of a table for every combination of
+    values of the key columns, as a dict of value tuple to count
+    '''
+    columns = [table[key] for key in keys]
+    weights = table['count']
+    if not len(columns[0]):
+        return {}
+    if np is None:
+        counts = Counter()
+        for values, weight in zip(zip(*columns), weights):
+            counts[values] += weight
+        return dict(counts)
+
+    # fold the key columns into one integer per row when they fit, which
+    # lets np.unique run on a flat array
+    sizes = [int(column.max()) + 1 for column in columns]
+    space = 1
+    for size in sizes:
+        space *= size
+    if space < 2 ** 62:
+        combined = np.zeros(len(columns[0]), dtype=np.int64)
+        for column, size in zip(columns, sizes):
+            combined = combined * size + column
+        values, inverse = np.unique(combined, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=weights).astype(np.int64)
+        keys = []
+        for size in reversed(sizes):
+            keys.append(values % size)
+            values = values // size
+        keys.reverse()
+        return dict(zip(zip(*[k.tolist() for k in keys]), counts.tolist()))
+
+    rows, inverse = np.unique(np.column_stack(columns), axis=0, return_inverse=True)
+    counts = np.bincount(inverse.reshape(-1), weights=weights).astype(np.int64)
+    return dict(zip(map(tuple, rows.tolist()), counts.tolist()))
+
+
+def load_columns(survey, products=None, start=None, end=None, completed_only=True):
+    '''
+    Loads the answers to a survey as AnswerColumns, counted with two GROUP BY
+    queries. Picks of choices the survey no longer offers are left out.
+    '''
+    answers = _counted(Answer.objects.non_polymorphic(), 'answered_survey__', ('question_id', ),
+                       survey, products, start, end, completed_only)
+    picks = _counted(ChoiceAnswer.answer.through.objects.filter(choice_id__in=offered_choices(survey)),
+                     'choiceanswer__answered_survey__', ('choiceanswer__question_id', 'choice_id'),
+                     survey, products, start, end, completed_only)
+    return AnswerColumns.from_rows(answers, picks)
+
+
+def _counted(queryset, path, keys, survey, products, start, end, completed_only):
+    '''
+    Counts the rows of a queryset per product, month and key fields, as
+    (product, period, key values..., count) tuples. path leads from the
+    queryset's model to Answered_Survey.
+    '''
+    filters = {path + 'survey_id': survey.id}
+    if completed_only:
+        filters[path + 'completed'] = True
+    if products:
+        filters[path + 'engagement__product_id__in'] = [getattr(p, 'pk', p) for p in products]
+    if start:
+        filters[path + 'answered_on__gte'] = start
+    if end:
+        filters[path + 'answered_on__lte'] = end
+
+    rows = queryset.filter(**filters).annotate(month=TruncMonth(path + 'answered_on')).order_by().values_list(
+        path + 'engagement__product_id', 'month', *keys).annotate(count=Count('pk'))
+    return [(product_id or 0, _period(month)) + tuple(rest) for product_id, month, *rest in rows]
+
+
+def _period(answered_on):
+    return answered_on.year * 100 + answered_on.month if answered_on else 0
+
+
+def format_period(period):
+    return '%04d-%02d' % divmod(period, 100) if period else ''
+
+
+class SurveyReport(object):
+    '''
+    Choice distributions of a survey overall, per product and per month.
+    Each result row is a dict with the question, the choice, how many
+    answers picked it and what share of the question's answers that is.
+    '''
+
+    def __init__(self, survey, columns, product_names=None):
+        self.survey = survey
+        self.columns = columns
+        self.product_names = product_names or {}
+        self.questions = get_schema(survey).questions
+
+    @classmethod
+    def load(cls, survey, products=None, start=None, end=None, completed_only=True):
+        columns = load_columns(survey, products, start, end, completed_only)
+        product_ids = set(count_by(columns.answers, ('product', ))) - {(0, )}
+        names = dict(Product.objects.filter(id__in=[p for p, in product_ids]).values_list('id', 'name'))
+        return cls(survey, columns, names)
+
+    def _rows(self, scope):
+        '''
+        Rows for a grouping scope, None for the whole survey, or 'product'
+        or 'period'
+        '''
+        keys = (scope, ) if scope else ()
+        answered = count_by(self.columns.answers, keys + ('question', ))
+        picked = count_by(self.columns.picks, keys + ('question', 'choice'))
+        groups = sorted(set(key[:-1] for key in answered))
+
+        rows = []
+        for group in groups:
+            for question in self.questions:
+                answers = answered.get(group + (question.id, ), 0)
+                if not answers:
+                    continue
+                row = {'question': question.id, 'text': question.text, 'answers': answers}
+                if scope == 'product':
+                    row['product'] = group[0]
+                    row['product_name'] = self.product_names.get(group[0], '')
+                elif scope == 'period':
+                    row['period'] = format_period(group[0])
+                if question.type != CHOICE:
+                    rows.append(dict(row, choice=None, label='', count=answers, percent=100.0))
+                    continue
+                for choice in question.choices:
+                    count = picked.get(group + (question.id, choice.id), 0)
+                    rows.append(dict(row, choice=choice.id, label=choice.label, count=count,
+                                     percent=round(100.0 * count / answers, 1)))
+        return rows
+
+    def distribution(self):
+        return self._rows(None)
+
+    def by_product(self):
+        return self._rows('product')
+
+    def by_period(self):
+        return self._rows('period')
+
+    def as_dict(self):
+        return {'survey': self.survey.id,
+                'name': self.survey.name,
+                'distribution': self.distribution(),
+                'products': self.by_product(),
+                'periods': self.by_period()}
+
+    def write_csv(self, out):
+        '''
+        Writes every row of the report to a file like object as CSV
+        '''
+        writer = csv.writer(out)
+        writer.writerow(['scope', 'group', 'question', 'choice', 'count', 'answers', 'percent'])
+        for scope, rows, group in (('survey', self.distribution(), lambda row: ''),
+                                   ('product', self.by_product(), lambda row: row['product_name']),
+                                   ('period', self.by_period(), lambda row: row['period'])):
+            for row in rows:
+                writer.writerow([scope, group(row), row['text'], row['label'], row['count'], row['answers'],
+                                 row['percent']])
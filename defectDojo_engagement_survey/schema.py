@@ -0,0 +1,160 @@
+'''
+Compiled structure of an Engagement_Survey.
+
+The questions of a survey change rarely but are read on every page that
+renders it, so they are compiled into immutable tuples and cached both in
+process and in Django's cache backend. A per-survey version kept in the
+cache backend tells every process when its copy is stale; signals.py bumps
+it whenever a survey, question or choice changes.
+'''
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from .metrics import cache_lookup
+from .models import ChoiceQuestion, Engagement_Survey, Question
+
+TEXT = 'text'
+CHOICE = 'choice'
+
+VERSION_KEY = 'survey_schema_version:%s'
+SCHEMA_KEY = 'survey_schema:%s:%s'
+
+# survey id -> SurveySchema, checked against the shared version on every read
+_schemas = {}
+
+
+class ChoiceSchema(namedtuple('ChoiceSchema', ['id', 'label'])):
+    __slots__ = ()
+
+
+class QuestionSchema(namedtuple('QuestionSchema', ['id', 'type', 'order', 'text', 'optional', 'multichoice',
+                                                   'choices'])):
+    '''
+    A question with its choices, in render order
+    '''
+    __slots__ = ()
+
+    def get_form(self):
+        '''
+        Returns the form for this question
+        '''
+        from .forms import TextQuestionForm, ChoiceQuestionForm
+        if self.type == CHOICE:
+            return ChoiceQuestionForm
+        return TextQuestionForm
+
+
+class SurveySchema(namedtuple('SurveySchema', ['id', 'version', 'questions'])):
+    __slots__ = ()
+
+
+def compile_question(question):
+    '''
+    Returns the QuestionSchema of a single Question instance
+    '''
+    if isinstance(question, ChoiceQuestion):
+        return QuestionSchema(question.id, CHOICE, question.order, question.text, question.optional,
+                              question.multichoice,
+                              tuple(ChoiceSchema(c.id, c.label) for c in question.choices.all()))
+    return QuestionSchema(question.id, TEXT, question.order, question.text, question.optional, False, ())
+
+
+def compile_schema(survey_id, version=None):
+    '''
+    Builds the schema of a survey with three queries, whatever its size
+    '''
+    choice_type = ContentType.objects.get_for_model(ChoiceQuestion, for_concrete_model=False)
+
+    rows = list(Question.objects.non_polymorphic().filter(
+        engagement_survey__id=survey_id
+    ).order_by('order', 'id').values_list('id', 'polymorphic_ctype_id', 'order', 'text', 'optional'))
+
+    choice_ids = [row[0] for row in rows if row[1] == choice_type.id]
+    multichoice = {}
+    choices = {}
+    if choice_ids:
+        multichoice = dict(ChoiceQuestion.objects.non_polymorphic().filter(
+            pk__in=choice_ids).values_list('pk', 'multichoice'))
+        selected = ChoiceQuestion.choices.through.objects.filter(
+            choicequestion_id__in=choice_ids
+        ).order_by('choice__order', 'choice_id').values_list('choicequestion_id', 'choice_id', 'choice__label')
+        for question_id, choice_id, label in selected:
+            choices.setdefault(question_id, []).append(ChoiceSchema(choice_id, label))
+
+    questions = []
+    for question_id, ctype_id, order, text, optional in rows:
+        if ctype_id == choice_type.id:
+            questions.append(QuestionSchema(question_id, CHOICE, order, text, optional,
+                                            multichoice.get(question_id, False),
+                                            tuple(choices.get(question_id, ()))))
+        else:
+            questions.append(QuestionSchema(question_id, TEXT, order, text, optional, False, ()))
+
+    return SurveySchema(survey_id, version, tuple(questions))
+
+
+def schema_version(survey_id):
+    '''
+    Returns the current schema version of a survey
+    '''
+    key = VERSION_KEY % survey_id
+    version = cache.get(key)
+    if version is None:
+        # first use, or evicted: start from a fresh version so stale copies never match
+        version = uuid.uuid4().hex
+        cache.add(key, version, None)
+        version = cache.get(key) or version
+    return version
+
+
+def get_schema(survey):
+    '''
+    Returns the cached SurveySchema of an Engagement_Survey or survey id
+    '''
+    survey_id = survey.id if isinstance(survey, Engagement_Survey) else int(survey)
+    version = schema_version(survey_id)
+
+    schema = _schemas.get(survey_id)
+    if schema is not None and schema.version == version:
+        cache_lookup('schema', True)
+        return schema
+
+    key = SCHEMA_KEY % (survey_id, version)
+    schema = cache.get(key)
+    cache_lookup('schema', schema is not None)
+    if schema is None:
+        schema = compile_schema(survey_id, version)
+        cache.set(key, schema, getattr(settings, 'SURVEY_SCHEMA_CACHE_TIMEOUT', 60 * 60 * 24))
+
+    _schemas[survey_id] = schema
+    return schema
+
+
+def invalidate_schemas(survey_ids):
+    '''
+    Marks the cached schemas of the given surveys as stale in every process
+    '''
+    for survey_id in set(survey_ids):
+        cache.set(VERSION_KEY % survey_id, uuid.uuid4().hex, None)
+        _schemas.pop(survey_id, None)
+
+
+def surveys_with_questions(question_ids):
+    '''
+    Returns the ids of the surveys that include any of the given questions
+    '''
+    return list(Engagement_Survey.questions.through.objects.filter(
+        question_id__in=question_ids).values_list('engagement_survey_id', flat=True).distinct())
+
+
+def surveys_with_choices(choice_ids):
+    '''
+    Returns the ids of the surveys that offer any of the given choices
+    '''
+    question_ids = ChoiceQuestion.choices.through.objects.filter(
+        choice_id__in=choice_ids).values_list('choicequestion_id', flat=True)
+    return surveys_with_questions(question_ids)
@@ -0,0 +1,142 @@
+'''
+Signal handlers keeping the cached survey schemas in sync with the
+questions, choices and surveys they were compiled from, and the compact
+answer copies in sync with answers edited outside answers.py.
+'''
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from dojo.models import Engagement, System_Settings
+
+from .access import invalidate_system_settings
+from .answers import forget_documents, resync_selections, strip_choice
+from .deletion import delete_engagement_answers, delete_survey_answers, unlink_general_survey
+from .models import Answer, Answered_Survey, Choice, ChoiceAnswer, ChoiceQuestion, Engagement_Survey, \
+    General_Survey, Question, TextAnswer, TextQuestion
+from .pages import invalidate_blank_page, invalidate_blank_pages
+from .schema import invalidate_schemas, surveys_with_choices, surveys_with_questions
+from .statistics import forget_choice, forget_question
+
+M2M_ACTIONS = ('post_add', 'post_remove', 'pre_clear')
+
+
+def _invalidate_on_commit(survey_ids):
+    # work out the surveys now, the rows may be gone once the transaction commits
+    survey_ids = list(survey_ids)
+    if survey_ids:
+        transaction.on_commit(lambda: invalidate_schemas(survey_ids))
+
+
+@receiver(m2m_changed, sender=Engagement_Survey.questions.through)
+def survey_questions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if not reverse:
+        _invalidate_on_commit([instance.pk])
+    elif pk_set:
+        _invalidate_on_commit(pk_set)
+    else:
+        _invalidate_on_commit(surveys_with_questions([instance.pk]))
+
+
+@receiver(m2m_changed, sender=ChoiceQuestion.choices.through)
+def question_choices_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in M2M_ACTIONS:
+        return
+    if not reverse:
+        _invalidate_on_commit(surveys_with_questions([instance.pk]))
+    elif pk_set:
+        _invalidate_on_commit(surveys_with_questions(pk_set))
+    else:
+        _invalidate_on_commit(surveys_with_choices([instance.pk]))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=TextQuestion)
+@receiver(post_save, sender=ChoiceQuestion)
+@receiver(pre_delete, sender=Question)
+@receiver(pre_delete, sender=TextQuestion)
+@receiver(pre_delete, sender=ChoiceQuestion)
+def question_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(surveys_with_questions([instance.pk]))
+
+
+@receiver(pre_delete, sender=Question)
+@receiver(pre_delete, sender=TextQuestion)
+@receiver(pre_delete, sender=ChoiceQuestion)
+def question_deleted(sender, instance, using, **kwargs):
+    # the collector deletes the question's answers next
+    forget_question(instance.pk, using)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(pre_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(surveys_with_choices([instance.pk]))
+
+
+@receiver(pre_delete, sender=Choice)
+def choice_deleted(sender, instance, using, **kwargs):
+    # answers that picked it keep their other choices
+    strip_choice(instance.pk)
+    forget_choice(instance.pk, using)
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_save, sender=TextAnswer)
+@receiver(post_save, sender=ChoiceAnswer)
+@receiver(post_delete, sender=Answer)
+def answer_changed(sender, instance, using, **kwargs):
+    # write_answers() saves in bulk and keeps the documents itself, this
+    # covers the admin and deleted questions; deleting a child also deletes
+    # its Answer row
+    forget_documents(Answered_Survey._base_manager.using(using).filter(pk=instance.answered_survey_id))
+
+
+@receiver(m2m_changed, sender=ChoiceAnswer.answer.through)
+def choice_answer_selection_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            resync_selections([instance.pk], using)
+    elif action in ('post_add', 'post_remove'):
+        resync_selections(pk_set, using)
+    elif action == 'pre_clear':
+        strip_choice(instance.pk)
+
+
+@receiver(post_save, sender=Engagement_Survey)
+@receiver(post_delete, sender=Engagement_Survey)
+def survey_changed(sender, instance, **kwargs):
+    _invalidate_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=General_Survey)
+@receiver(post_delete, sender=General_Survey)
+def general_survey_changed(sender, instance, **kwargs):
+    general_survey_id = instance.pk
+    transaction.on_commit(lambda: invalidate_blank_page(general_survey_id))
+
+
+@receiver(pre_delete, sender=General_Survey)
+def general_survey_deleted(sender, instance, **kwargs):
+    # a single UPDATE instead of the collector loading every response
+    unlink_general_survey(instance)
+
+
+@receiver(post_save, sender=System_Settings)
+def system_settings_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_system_settings)
+    transaction.on_commit(invalidate_blank_pages)
+
+
+@receiver(pre_delete, sender=Engagement)
+def engagement_deleted(sender, instance, **kwargs):
+    delete_engagement_answers(instance)
+
+
+@receiver(pre_delete, sender=Engagement_Survey)
+def survey_deleted(sender, instance, **kwargs):
+    # inside the collector's transaction, so never chunked, see
+    # deletion.delete_survey_with_answers(); the survey's statistics go with it
+    delete_survey_answers(instance, chunk_size=False, statistics=False)
@@ -0,0 +1,196 @@
+'''
+Opt-in capture of slow queries issued by the survey plugin.
+
+With SURVEY_SLOW_QUERY_MS set, every database connection gets an execute
+wrapper that times each statement. A statement slower than the threshold
+whose stack passes through this package is recorded with its parameters,
+where it came from (the innermost survey function, the view or command it
+ran under and the template being rendered) and, for SELECTs, the backend's
+EXPLAIN output. Each capture is written as a JSON line to the
+defectDojo_engagement_survey.slow_queries logger, and to a rotating file
+when SURVEY_SLOW_QUERY_LOG names one. The worst statements of the process,
+grouped by fingerprint, are listed for staff at /survey/slow_queries.
+
+Statements under the threshold only cost two clock reads.
+'''
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+from .queries import fingerprint
+
+logger = logging.getLogger('defectDojo_engagement_survey.slow_queries')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+# frames of these modules wrap every query and say nothing about its origin
+WRAPPER_MODULES = tuple(os.path.join(PACKAGE_DIR, name) for name in ('slowqueries.py', 'queries.py',
+                                                                       'middleware.py'))
+
+_local = threading.local()
+
+
+def slow_query_threshold():
+    '''
+    The threshold in milliseconds, or None when slow queries aren't captured
+    '''
+    return getattr(settings, 'SURVEY_SLOW_QUERY_MS', None)
+
+
+def _describe(frame):
+    code = frame.f_code
+    name = code.co_name
+    owner = frame.f_locals.get('self')
+    if owner is not None:
+        name = '%s.%s' % (type(owner).__name__, name)
+    return '%s:%d %s' % (os.path.relpath(code.co_filename, PACKAGE_DIR), frame.f_lineno, name)
+
+
+def call_site(frame):
+    '''
+    Returns (site, origin, template) for a statement run below frame: the
+    innermost and outermost survey functions on the stack and the innermost
+    template being rendered, or None if no survey code is on the stack
+    '''
+    site = origin = template = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PACKAGE_DIR) and not filename.startswith(WRAPPER_MODULES):
+            origin = _describe(frame)
+            if site is None:
+                site = origin
+        elif template is None and frame.f_code.co_name == 'render' and \
+                isinstance(frame.f_locals.get('self'), Template):
+            template = frame.f_locals['self'].name
+        frame = frame.f_back
+    if site is None:
+        return None
+    return site, origin, template
+
+
+def explain(connection, sql, params):
+    '''
+    The backend's plan for a SELECT, or an empty string
+    '''
+    if not sql.lstrip()[:6].upper() == 'SELECT':
+        return ''
+    _local.explaining = True
+    try:
+        # in a savepoint, so a failing EXPLAIN can't break the transaction it ran in
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute('%s %s' % (connection.ops.explain_query_prefix(), sql), params)
+                return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except DatabaseError as e:
+        return 'EXPLAIN failed: %s' % e
+    finally:
+        _local.explaining = False
+
+
+class SlowQueries(object):
+    '''
+    The slowest statements of this process, grouped by fingerprint, keeping
+    at most `keep` of them
+    '''
+
+    def __init__(self, keep=200):
+        self.keep = keep
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, duration_ms):
+        '''
+        Counts a capture and returns its entry, and whether it is the slowest
+        run of its statement so far
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.keep:
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k]['total_ms'])]
+                entry = self._entries[key] = {'fingerprint': key, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            slowest = duration_ms > entry['max_ms']
+            if slowest:
+                entry['max_ms'] = duration_ms
+            return entry, slowest
+
+    def worst(self, limit=50):
+        '''
+        The entries with the most time spent, most first
+        '''
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SLOW_QUERIES = SlowQueries()
+
+
+def profile_query(execute, sql, params, many, context):
+    '''
+    Execute wrapper that captures the statement when it is slow
+    '''
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    threshold = slow_query_threshold()
+    if threshold is None or duration_ms < threshold or getattr(_local, 'explaining', False):
+        return result
+    where = call_site(sys._getframe(1))
+    if where is None:
+        return result
+
+    site, origin, template = where
+    entry, slowest = SLOW_QUERIES.add(fingerprint(sql), duration_ms)
+    capture = {'duration_ms': round(duration_ms, 2),
+               'sql': sql,
+               'params': repr(params)[:1000],
+               'many': many,
+               'site': site,
+               'origin': origin,
+               'template': template,
+               'database': context['connection'].alias}
+    # a plan per statement and whenever it got slower, not for every run
+    if slowest:
+        if not many:
+            capture['plan'] = explain(context['connection'], sql, params)
+        entry.update(capture)
+    logger.warning(json.dumps(capture, default=str))
+    return result
+
+
+def _connection_created(sender, connection, **kwargs):
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+def install():
+    '''
+    Profiles every database connection opened from now on and sets up the
+    rotating log file, called by the app config when SURVEY_SLOW_QUERY_MS
+    is set
+    '''
+    SLOW_QUERIES.keep = getattr(settings, 'SURVEY_SLOW_QUERY_KEEP', 200)
+    path = getattr(settings, 'SURVEY_SLOW_QUERY_LOG', None)
+    if path and not any(isinstance(handler, RotatingFileHandler) for handler in logger.handlers):
+        handler = RotatingFileHandler(path,
+                                      maxBytes=getattr(settings, 'SURVEY_SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024),
+                                      backupCount=getattr(settings, 'SURVEY_SLOW_QUERY_LOG_BACKUPS', 5))
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+    connection_created.connect(_connection_created, dispatch_uid='survey_slow_queries')
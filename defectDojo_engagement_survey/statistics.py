@@ -0,0 +1,221 @@
+'''
+Running response statistics of every survey.
+
+Survey_Statistic rows count the completed responses of a survey, the
+answers to each of its questions and the picks of each choice. They are
+adjusted right after the transaction writing the answers they count
+commits: write_answers() records what a submission adds or changes,
+mark_completed() and reset_completion() the completion flips, deletion.py
+what it removes, and edits in the Django admin recount the surveys they
+touch. The results page and its JSON twin read a handful of rows per
+question, however many responses there are. rebuild_statistics()
+recomputes them from the answer tables, or only checks them, should a
+process die between a commit and its adjustment or answers be changed
+some other way.
+'''
+from collections import Counter
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F
+
+from .answers import supports_upsert
+from .models import Answer, Answered_Survey, Engagement_Survey, Survey_Statistic
+from .schema import CHOICE, get_schema
+from .tallies import choice_tallies
+
+
+def record_statistics(deltas, using=None):
+    '''
+    Adds deltas, a mapping of (survey id, question id, choice id) to a
+    positive or negative change, to the statistics once the current
+    transaction commits, or straight away outside of one. Submissions so
+    never hold a lock on the counter rows every respondent of a survey
+    shares; the rows are only locked for the one upsert applying the deltas.
+    Deltas of a transaction that rolls back are dropped with it.
+    '''
+    deltas = dict((key, delta) for key, delta in deltas.items() if delta)
+    if not deltas:
+        return
+    if using is None:
+        using = router.db_for_write(Survey_Statistic)
+    transaction.on_commit(lambda: apply_statistics(deltas, using), using=using)
+
+
+def apply_statistics(deltas, using=None):
+    '''
+    Writes deltas to the statistics with one upsert per batch. Rows are
+    written in key order, so concurrent upserts lock them in the same order
+    and can't deadlock.
+    '''
+    deltas = sorted((key, delta) for key, delta in deltas.items() if delta)
+    if not deltas:
+        return
+
+    if using is None:
+        using = router.db_for_write(Survey_Statistic)
+    connection = connections[using]
+
+    if not supports_upsert(connection):
+        for (survey_id, question_id, choice_id), delta in deltas:
+            _add_statistic(survey_id, question_id, choice_id, delta, using)
+        return
+
+    quote_name = connection.ops.quote_name
+    meta = Survey_Statistic._meta
+    fields = [meta.get_field(name) for name in ('survey', 'question_id', 'choice_id', 'total')]
+    columns = [quote_name(field.column) for field in fields]
+    table = quote_name(meta.db_table)
+    total = columns[-1]
+
+    if connection.vendor == 'mysql':
+        conflict = 'ON DUPLICATE KEY UPDATE %s = %s + VALUES(%s)' % (total, total, total)
+    else:
+        conflict = 'ON CONFLICT (%s) DO UPDATE SET %s = %s.%s + excluded.%s' % (
+            ', '.join(columns[:-1]), total, table, total, total)
+
+    rows = [key + (delta, ) for key, delta in deltas]
+    batch_size = max(connection.ops.bulk_batch_size(fields, rows), 1)
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                'INSERT INTO ' + table + ' (' + ', '.join(columns) + ') VALUES ' +
+                ', '.join(['(%s, %s, %s, %s)'] * len(batch)) + ' ' + conflict,
+                [value for row in batch for value in row])
+
+
+def _add_statistic(survey_id, question_id, choice_id, delta, using, attempts=3):
+    # a concurrent request may create the same row between the lookup and
+    # the insert, the next attempt then finds it
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic(using=using):
+                statistic, created = Survey_Statistic.objects.using(using).get_or_create(
+                    survey_id=survey_id, question_id=question_id, choice_id=choice_id,
+                    defaults={'total': delta})
+                if not created:
+                    Survey_Statistic.objects.using(using).filter(pk=statistic.pk).update(total=F('total') + delta)
+            return
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def negated(deltas):
+    return dict((key, -delta) for key, delta in deltas.items())
+
+
+def completion_statistics(answered_surveys):
+    '''
+    Counts the completed responses of an Answered_Survey queryset, keyed
+    like record_statistics() deltas
+    '''
+    rows = answered_surveys.filter(completed=True).order_by().values('survey_id').annotate(n=Count('id'))
+    return Counter(dict(((row['survey_id'], 0, 0), row['n']) for row in rows))
+
+
+def answer_statistics(answers):
+    '''
+    Counts the answers of an Answer queryset and the choices they pick with
+    one scan, keyed like record_statistics() deltas
+    '''
+    counts = Counter()
+    tallies = choice_tallies(answers, ('answered_survey__survey_id', 'question_id'), selected='choiceanswer__selected')
+    for (survey_id, question_id), tally in tallies.items():
+        counts[(survey_id, question_id, 0)] += tally.responses
+        counts.update(dict(((survey_id, question_id, choice_id), n) for choice_id, n in tally.counts.items()))
+    return counts
+
+
+def stored_statistics(survey_id, using=None):
+    '''
+    Returns the statistics of a survey as (question id, choice id) to total
+    '''
+    return dict(((question_id, choice_id), total)
+                for question_id, choice_id, total in Survey_Statistic.objects.using(using).filter(
+                    survey_id=survey_id).exclude(total=0).values_list('question_id', 'choice_id', 'total'))
+
+
+def rebuild_statistics(survey_ids=None, verify=False):
+    '''
+    Recomputes the statistics of the given surveys, or of all of them, from
+    the answer tables, one survey per transaction. Run it while no answers
+    are being saved. With verify, nothing is written. Returns the ids of the
+    surveys whose statistics were wrong.
+    '''
+    using = router.db_for_write(Survey_Statistic)
+    if survey_ids is None:
+        survey_ids = Engagement_Survey.objects.using(using).order_by('id').values_list('id', flat=True)
+
+    wrong = []
+    for survey_id in survey_ids:
+        with transaction.atomic(using=using):
+            counts = completion_statistics(Answered_Survey.objects.using(using).filter(survey_id=survey_id))
+            counts.update(answer_statistics(Answer.objects.non_polymorphic().using(using).filter(
+                answered_survey__survey_id=survey_id)))
+            expected = dict(((question_id, choice_id), total)
+                            for (s, question_id, choice_id), total in counts.items() if total)
+
+            if stored_statistics(survey_id, using) == expected:
+                continue
+            wrong.append(survey_id)
+            if verify:
+                continue
+
+            Survey_Statistic.objects.using(using).filter(survey_id=survey_id).delete()
+            Survey_Statistic.objects.using(using).bulk_create([
+                Survey_Statistic(survey_id=survey_id, question_id=question_id, choice_id=choice_id, total=total)
+                for (question_id, choice_id), total in expected.items()])
+    return wrong
+
+
+def _forget(using=None, **filters):
+    # like the deltas, only once the delete commits, so a rollback keeps them
+    if using is None:
+        using = router.db_for_write(Survey_Statistic)
+    transaction.on_commit(lambda: Survey_Statistic.objects.using(using).filter(**filters).delete(), using=using)
+
+
+def forget_question(question_id, using=None):
+    '''
+    Drops the statistics of a question whose answers are being deleted,
+    once the delete commits
+    '''
+    _forget(using, question_id=question_id)
+
+
+def forget_choice(choice_id, using=None):
+    '''
+    Drops the statistics of a choice that is being deleted, once the delete
+    commits
+    '''
+    _forget(using, choice_id=choice_id)
+
+
+def survey_results(survey):
+    '''
+    Returns the results of an Engagement_Survey for display or export, one
+    dict per question of its current schema
+    '''
+    stats = stored_statistics(survey.id)
+    completed = stats.get((0, 0), 0)
+
+    questions = []
+    for question in get_schema(survey).questions:
+        answers = stats.get((question.id, 0), 0)
+        choices = [{'id': choice.id,
+                    'label': choice.label,
+                    'count': stats.get((question.id, choice.id), 0),
+                    'percent': round(100.0 * stats.get((question.id, choice.id), 0) / answers, 1) if answers else 0}
+                   for choice in question.choices]
+        questions.append({'id': question.id,
+                          'text': question.text,
+                          'type': question.type,
+                          'multichoice': question.multichoice,
+                          'answers': answers,
+                          'choices': choices if question.type == CHOICE else []})
+
+    return {'survey': survey.id,
+            'name': survey.name,
+            'completed': completed,
+            'questions': questions}
@@ -0,0 +1,233 @@
+'''
+Synthetic surveys, engagements and answers for benchmarks and load tests.
+
+Everything is derived from a random.Random, so the same seed builds the
+same data. Rows are written with bulk inserts, questions through the same
+child table insert answers.py uses, and answers through
+answers.write_answers(), a batch of answered surveys per call, so they are
+stored exactly like real submissions. Every name, question text and choice
+label starts with PREFIX, which is how cleanup() finds them again.
+'''
+from datetime import date, timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import router, transaction
+from django.utils import timezone
+
+from dojo.models import Engagement, Product, Product_Type
+
+from .answers import insert_children, write_answers
+from .deletion import delete_answered_surveys
+from .models import Answered_Survey, Choice, ChoiceQuestion, Engagement_Survey, General_Survey, Question, \
+    TextQuestion
+from .schema import CHOICE, get_schema, invalidate_schemas
+from .statistics import record_statistics
+
+PREFIX = '[synthetic]'
+
+WORDS = ('access', 'audit', 'backup', 'build', 'cloud', 'control', 'data', 'deploy', 'encryption',
+         'incident', 'key', 'log', 'network', 'owner', 'patch', 'policy', 'release', 'review',
+         'risk', 'secret', 'service', 'storage', 'test', 'third party', 'user', 'vendor')
+
+
+def sentence(rng, words=8):
+    return ' '.join(rng.choice(WORDS) for i in range(words)).capitalize()
+
+
+def _run(rng):
+    # tells apart the rows of separate runs with the same seed
+    return '%08x' % rng.getrandbits(32)
+
+
+def seed_engagements(rng, products, engagements):
+    '''
+    Creates products of a synthetic product type, with the engagements
+    spread over them. Returns the engagements.
+    '''
+    run = _run(rng)
+    product_type, created = Product_Type.objects.get_or_create(name='%s products' % PREFIX)
+    # through save(), dojo keeps derived state on both models
+    created = [Product.objects.create(name='%s %s product %d' % (PREFIX, run, i),
+                                      description=sentence(rng), prod_type=product_type)
+               for i in range(max(1, products))]
+    return [Engagement.objects.create(product=created[i % len(created)],
+                                      target_start=date.today(),
+                                      target_end=date.today() + timedelta(days=7))
+            for i in range(engagements)]
+
+
+def seed_engagement(rng):
+    '''
+    Creates a product with one engagement to attach answered surveys to
+    '''
+    return seed_engagements(rng, 1, 1)[0]
+
+
+def _read_back(objs, model, field):
+    '''
+    Fills in the ids of bulk created rows on backends that don't return
+    them, by their unique value of field
+    '''
+    if all(obj.pk for obj in objs):
+        return objs
+    values = [getattr(obj, field) for obj in objs]
+    ids = {}
+    # SQLite allows 999 query parameters
+    for start in range(0, len(values), 500):
+        ids.update(model._base_manager.filter(**{field + '__in': values[start:start + 500]}
+                                              ).values_list(field, 'pk'))
+    for obj in objs:
+        obj.pk = ids[getattr(obj, field)]
+    return objs
+
+
+def seed_question_bank(rng, count, choices=5, largest=None, batch_size=500):
+    '''
+    Creates count questions, every other one a choice question offering two
+    to `choices` choices, the first one `largest` choices if given. Returns
+    the question ids.
+    '''
+    run = _run(rng)
+    using = router.db_for_write(Question)
+    text_type = ContentType.objects.get_for_model(TextQuestion, for_concrete_model=False)
+    choice_type = ContentType.objects.get_for_model(ChoiceQuestion, for_concrete_model=False)
+
+    question_ids = []
+    for start in range(0, count, batch_size):
+        with transaction.atomic(using=using):
+            questions = [Question(order=i + 1,
+                                  optional=rng.random() < 0.2,
+                                  text='%s %s %d %s?' % (PREFIX, run, i + 1, sentence(rng)),
+                                  polymorphic_ctype=choice_type if i % 2 else text_type)
+                         for i in range(start, min(start + batch_size, count))]
+            _read_back(Question.objects.using(using).bulk_create(questions), Question, 'text')
+
+            choice_questions = [q for q in questions if q.polymorphic_ctype_id == choice_type.id]
+            insert_children(TextQuestion, [], [(q.pk, ) for q in questions
+                                               if q.polymorphic_ctype_id == text_type.id], using)
+            insert_children(ChoiceQuestion, ['multichoice'], [(q.pk, rng.random() < 0.3)
+                                                              for q in choice_questions], using)
+
+            offered = []
+            for question in choice_questions:
+                n = largest if largest and question.order == 2 else rng.randint(2, choices)
+                offered.append((question, [Choice(order=j + 1,
+                                                  label='%s %s %d.%d %s' % (PREFIX, run, question.order, j + 1,
+                                                                            rng.choice(WORDS)))
+                                           for j in range(n)]))
+            _read_back(Choice.objects.using(using).bulk_create([c for q, options in offered for c in options],
+                                                               batch_size=batch_size), Choice, 'label')
+            ChoiceQuestion.choices.through.objects.using(using).bulk_create([
+                ChoiceQuestion.choices.through(choicequestion_id=question.pk, choice_id=choice.pk)
+                for question, options in offered for choice in options], batch_size=batch_size)
+            question_ids.extend(q.pk for q in questions)
+    return question_ids
+
+
+def seed_survey(rng, questions, choices=5, name=None, bank=None):
+    '''
+    Creates a survey of the given number of questions, drawn from a bank of
+    question ids, or new questions whose first choice question offers
+    `choices` choices and the others up to five
+    '''
+    if bank is None:
+        question_ids = seed_question_bank(rng, questions, min(choices, 5), largest=choices)
+    else:
+        question_ids = rng.sample(bank, min(questions, len(bank)))
+
+    survey = Engagement_Survey.objects.create(name=name or '%s survey %s' % (PREFIX, _run(rng)),
+                                              description=sentence(rng))
+    Engagement_Survey.questions.through.objects.bulk_create([
+        Engagement_Survey.questions.through(engagement_survey_id=survey.pk, question_id=question_id)
+        for question_id in question_ids], batch_size=1000)
+    # the bulk inserts send no m2m_changed, and a rolled back run may have used this id
+    invalidate_schemas([survey.pk])
+    return survey
+
+
+def random_answers(rng, questions):
+    '''
+    Returns (text_values, choice_values) answering every question of a
+    schema, as answers.answer_values() does for submitted forms
+    '''
+    text_values = {}
+    choice_values = {}
+    for question in questions:
+        if question.type == CHOICE:
+            if question.choices:
+                picks = rng.randint(1, min(3, len(question.choices))) if question.multichoice else 1
+                choice_values[question.id] = [c.id for c in rng.sample(question.choices, picks)]
+        else:
+            text_values[question.id] = sentence(rng, rng.randint(3, 20))
+    return text_values, choice_values
+
+
+def answer_data(questions):
+    '''
+    POST data answering every question of a schema, as the answer pages
+    expect it
+    '''
+    data = {}
+    for question in questions:
+        field = '%d-answer' % question.id
+        if question.type != CHOICE:
+            data[field] = 'Benchmark answer to question %d' % question.id
+        elif question.choices:
+            data[field] = [c.id for c in question.choices[:2]] if question.multichoice else question.choices[0].id
+    return data
+
+
+def seed_answered_surveys(rng, survey, engagements, count, batch_size=500):
+    '''
+    Adds `count` completed and fully answered instances of a survey to each
+    engagement, batch_size answered surveys per transaction. Returns their
+    ids.
+    '''
+    questions = get_schema(survey).questions
+    using = router.db_for_write(Answered_Survey)
+    pending = [engagement for engagement in engagements for i in range(count)]
+    ids = []
+    for start in range(0, len(pending), batch_size):
+        with transaction.atomic(using=using):
+            answered = [Answered_Survey(survey=survey, engagement=engagement, completed=True,
+                                        answered_on=date.today() - timedelta(days=rng.randint(0, 720)))
+                        for engagement in pending[start:start + batch_size]]
+            Answered_Survey.objects.using(using).bulk_create(answered)
+            if not all(a.pk for a in answered):
+                # backends that don't return ids from a bulk insert; nothing
+                # else may add answered surveys to this survey meanwhile
+                answered = list(Answered_Survey.objects.using(using).filter(
+                    survey=survey).order_by('-id')[:len(answered)])
+            write_answers(dict((a.pk, random_answers(rng, questions)) for a in answered), using)
+            record_statistics({(survey.pk, 0, 0): len(answered)}, using)
+            ids.extend(a.pk for a in answered)
+    return ids
+
+
+def seed_general_surveys(rng, surveys, count):
+    '''
+    Creates count general surveys of the given surveys, expiring over the
+    next month
+    '''
+    return General_Survey.objects.bulk_create([
+        General_Survey(survey=rng.choice(surveys),
+                       expiration=timezone.now() + timedelta(days=rng.randint(1, 30)))
+        for i in range(count)])
+
+
+def cleanup(batch_size=1000):
+    '''
+    Deletes everything created by this module, answers first in batches.
+    Returns the number of answers deleted.
+    '''
+    surveys = Engagement_Survey.objects.filter(name__startswith=PREFIX)
+    deleted = delete_answered_surveys(Answered_Survey.objects.filter(survey__in=surveys.values('id')), batch_size)
+    General_Survey.objects.filter(survey__in=surveys.values('id')).delete()
+    for survey in surveys:
+        survey.delete()
+    Question.objects.filter(text__startswith=PREFIX).delete()
+    Choice.objects.filter(label__startswith=PREFIX).delete()
+    for product in Product.objects.filter(name__startswith=PREFIX):
+        product.delete()
+    Product_Type.objects.filter(name__startswith=PREFIX).delete()
+    return deleted
@@ -0,0 +1,49 @@
+'''
+Per question distributions of choice answers.
+
+Every ChoiceAnswer keeps its selection in compact form next to the
+ChoiceAnswer.answer M2M, so counting the picks of each choice across a
+survey is a single scan of its answers instead of a join through the
+selection table. choice_tallies() is that scan, which the survey statistics
+count through. The cross-engagement reports group by month as well and
+leave the counting to the database, see reports.py.
+'''
+from collections import Counter, namedtuple
+
+from .answers import decode_selection
+from .schema import get_schema
+
+
+class ChoiceTally(namedtuple('ChoiceTally', ['responses', 'counts'])):
+    '''
+    How many answers a group has and how many of them picked each choice,
+    as a Counter of choice id
+    '''
+    __slots__ = ()
+
+
+def offered_choices(survey):
+    '''
+    The ids of the choices a survey's questions currently offer
+    '''
+    return set(choice.id for question in get_schema(survey).questions for choice in question.choices)
+
+
+def choice_tallies(answers, keys=('question_id', ), choice_ids=None, selected='selected'):
+    '''
+    Tallies an answers queryset grouped by the values of the key fields,
+    with one query, as key tuple to ChoiceTally. Pass an Answer queryset
+    with selected='choiceanswer__selected' to also count text answers, which
+    pick nothing. Picks of choices not in choice_ids, when given, are left
+    out, for choices deleted since they were picked.
+    '''
+    responses = Counter()
+    counts = {}
+    for row in answers.values_list(*(tuple(keys) + (selected, ))).iterator():
+        key = row[:-1]
+        responses[key] += 1
+        picked = decode_selection(row[-1] or '')
+        if choice_ids is not None:
+            picked = [choice_id for choice_id in picked if choice_id in choice_ids]
+        counts.setdefault(key, Counter()).update(picked)
+    return dict((key, ChoiceTally(n, counts[key])) for key, n in responses.items())
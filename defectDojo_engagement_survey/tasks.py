@@ -0,0 +1,39 @@
+'''
+Background runner for the periodic survey jobs, used by the
+run_survey_workers command for deployments without a scheduler for the
+individual management commands.
+'''
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask(threading.Thread):
+    '''
+    Calls func every interval seconds until stopped
+    '''
+    daemon = True
+
+    def __init__(self, name, interval, func, *args):
+        super(PeriodicTask, self).__init__(name=name)
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                result = self.func(*self.args)
+                if result:
+                    logger.info('%s processed %d rows', self.name, result)
+            except Exception:
+                logger.exception('%s failed', self.name)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
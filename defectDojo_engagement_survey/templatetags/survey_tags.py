@@ -4,22 +4,20 @@ Created on Feb 18, 2015
 @author: jay7958
 '''
 from django import template
-from ..models import Answered_Survey, Engagement_Survey
+from ..models import Answered_Survey, available_surveys
 
 register = template.Library()
 
 
 @register.inclusion_tag('defectDojo-engagement-survey/surveys.html')
 def show_surveys(engagement, users):
-    surveys = Answered_Survey.objects.filter(engagement=engagement)
+    surveys = Answered_Survey.objects.filter(engagement=engagement).select_related(
+        'survey', 'assignee', 'responder').order_by('id')
     return {'surveys': surveys}
 
 
 @register.inclusion_tag('defectDojo-engagement-survey/add_surveys.html')
 def add_surveys(engagement):
-    ids = [survey.survey.id for survey in
-           Answered_Survey.objects.filter(engagement=engagement)]
-    surveys = Engagement_Survey.objects.exclude(
-        id__in=ids)
+    surveys = available_surveys(engagement)
     return {'surveys': surveys,
             'eng': engagement}
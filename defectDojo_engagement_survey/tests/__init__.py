@@ -0,0 +1,9 @@
+'''
+Tests of the survey plugin. They need DefectDojo's models, so run them from
+a DefectDojo project that has the plugin installed:
+
+    python manage.py test defectDojo_engagement_survey
+
+The concurrency tests are skipped on SQLite, which runs one writer at a
+time, and the query plan check on anything but PostgreSQL and SQLite.
+'''
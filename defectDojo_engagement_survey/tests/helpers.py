@@ -0,0 +1,69 @@
+'''
+Shared setup for the survey tests, built on the synthetic data generator
+'''
+import random
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from dojo.models import System_Settings
+
+
+def seeded_rng():
+    return random.Random(0)
+
+
+def staff_client():
+    '''
+    A test client logged in as a new staff user
+    '''
+    user = get_user_model().objects.create(username='survey-test-%d' % get_user_model().objects.count(),
+                                           is_staff=True, is_superuser=True)
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def ensure_system_settings():
+    if not System_Settings.objects.exists():
+        System_Settings.objects.create()
+
+
+def count_queries(call, using='default'):
+    '''
+    Calls call twice and returns the number of queries of the second call,
+    once the caches are warm
+    '''
+    call()
+    with CaptureQueriesContext(connections[using]) as queries:
+        call()
+    return len(queries)
+
+
+def run_concurrently(call, count):
+    '''
+    Calls call from count threads started together, each on its own
+    database connection, and re-raises the first error any of them hit
+    '''
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def target(i):
+        try:
+            barrier.wait()
+            call(i)
+        except Exception as e:  # reported below
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=target, args=(i, )) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
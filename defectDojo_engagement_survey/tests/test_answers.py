@@ -0,0 +1,56 @@
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+
+from defectDojo_engagement_survey.answers import write_answers
+from defectDojo_engagement_survey.models import Answer, Answered_Survey
+from defectDojo_engagement_survey.schema import get_schema
+from defectDojo_engagement_survey.synthetic import random_answers, seed_engagement, seed_survey
+
+from .helpers import run_concurrently, seeded_rng
+
+
+class WriteAnswersStatementsTest(TestCase):
+    '''
+    write_answers() issues the same statements however many questions a
+    submission answers
+    '''
+
+    def statements(self, rng, questions):
+        survey = seed_survey(rng, questions)
+        answered_survey = Answered_Survey.objects.create(survey=survey, engagement=seed_engagement(rng))
+        answers = random_answers(rng, get_schema(survey).questions)
+        with CaptureQueriesContext(connection) as first:
+            write_answers({answered_survey.pk: answers})
+        # a resubmission updates every answer in place
+        with CaptureQueriesContext(connection) as again:
+            write_answers({answered_survey.pk: random_answers(rng, get_schema(survey).questions)})
+        return len(first), len(again)
+
+    def test_statements_do_not_grow_with_questions(self):
+        rng = seeded_rng()
+        self.assertEqual(self.statements(rng, 4), self.statements(rng, 60))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentSubmissionsTest(TransactionTestCase):
+    '''
+    Parallel submissions of the same answered survey never duplicate an
+    answer
+    '''
+
+    def test_parallel_submissions_write_one_answer_per_question(self):
+        rng = seeded_rng()
+        survey = seed_survey(rng, 20)
+        answered_survey = Answered_Survey.objects.create(survey=survey, engagement=seed_engagement(rng))
+        questions = get_schema(survey).questions
+        submissions = [random_answers(rng, questions) for i in range(8)]
+
+        run_concurrently(lambda i: write_answers({answered_survey.pk: submissions[i]}), len(submissions))
+
+        answers = Answer.objects.non_polymorphic().filter(answered_survey=answered_survey)
+        duplicates = answers.values('question_id').annotate(n=Count('id')).filter(n__gt=1)
+        self.assertFalse(duplicates.exists())
+        answered = set(submissions[0][0]) | set(submissions[0][1])
+        self.assertEqual(set(answers.values_list('question_id', flat=True)), answered)
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.test import TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from defectDojo_engagement_survey.models import General_Survey
+from defectDojo_engagement_survey.schema import get_schema
+from defectDojo_engagement_survey.synthetic import answer_data, seed_survey
+
+from .helpers import ensure_system_settings, run_concurrently, seeded_rng, staff_client
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentResponsesTest(TransactionTestCase):
+    '''
+    Concurrent responses to a general survey are all counted
+    '''
+
+    def test_response_count_is_exact(self):
+        ensure_system_settings()
+        survey = seed_survey(seeded_rng(), 5)
+        general_survey = General_Survey.objects.create(survey=survey, num_responses=3,
+                                                       expiration=timezone.now() + timedelta(days=1))
+        url = reverse('answer_empty_survey', args=(general_survey.id, ))
+        data = answer_data(get_schema(survey).questions)
+        clients = [staff_client() for i in range(10)]
+        statuses = []
+
+        run_concurrently(lambda i: statuses.append(clients[i].post(url, data).status_code), len(clients))
+
+        self.assertEqual(statuses, [302] * len(clients))
+        self.assertEqual(General_Survey.objects.get(pk=general_survey.pk).response_count(), 3 + len(clients))
+        self.assertEqual(General_Survey.objects.with_response_counts().get(pk=general_survey.pk).response_count(),
+                         3 + len(clients))
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.template import Context, Template
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from dojo.models import Engagement
+
+from defectDojo_engagement_survey.models import General_Survey
+from defectDojo_engagement_survey.synthetic import seed_answered_surveys, seed_engagement, seed_survey
+
+from .helpers import count_queries, ensure_system_settings, seeded_rng, staff_client
+
+ENGAGEMENT_TAGS = Template('{% load survey_tags %}{% show_surveys engagement users %}{% add_surveys engagement %}')
+
+
+class ListQueryCountTest(TestCase):
+    '''
+    The survey listings issue the same number of queries whatever the
+    number of rows they show
+    '''
+
+    def setUp(self):
+        ensure_system_settings()
+        self.rng = seeded_rng()
+        self.client = staff_client()
+        self.engagement = seed_engagement(self.rng)
+
+    def add_surveys(self, count):
+        for i in range(count):
+            survey = seed_survey(self.rng, 3)
+            seed_answered_surveys(self.rng, survey, [self.engagement], 1)
+            General_Survey.objects.create(survey=survey, expiration=timezone.now() + timedelta(days=1))
+
+    def test_survey_list(self):
+        self.add_surveys(1)
+        few = count_queries(lambda: self.client.get(reverse('survey')))
+        self.add_surveys(5)
+        self.assertNumQueries(few, lambda: self.client.get(reverse('survey')))
+
+    def test_engagement_survey_tags(self):
+        def render():
+            # a fresh engagement, add_surveys memoizes on the instance
+            engagement = Engagement.objects.get(pk=self.engagement.pk)
+            return ENGAGEMENT_TAGS.render(Context({'engagement': engagement, 'users': []}))
+        self.add_surveys(1)
+        few = count_queries(render)
+        self.add_surveys(5)
+        self.assertNumQueries(few, render)
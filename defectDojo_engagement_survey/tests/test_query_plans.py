@@ -0,0 +1,18 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'query plans are checked on PostgreSQL and SQLite')
+class QueryPlanTest(TestCase):
+    '''
+    The hot survey lookups are served by an index, see
+    check_survey_query_plans
+    '''
+
+    def test_hot_lookups_use_an_index(self):
+        # raises CommandError, listing the plans, on a sequential scan
+        call_command('check_survey_query_plans', stdout=StringIO())
@@ -3,6 +3,7 @@ Created on Feb 18, 2015
 
 @author: jay7958
 '''
+from django.conf import settings
 from django.conf.urls import url
 from django.contrib import admin
 from django.apps import apps
@@ -12,10 +13,20 @@ if not apps.ready:
 
 admin.autodiscover()
 
+answer_views = views
+if getattr(settings, 'SURVEY_ASYNC_VIEWS', False):
+    from defectDojo_engagement_survey import async_views as answer_views
+
 urlpatterns = [
     url(r'^survey$',
         views.survey,
         name='survey'),
+    url(r'^survey/metrics$',
+        views.survey_metrics,
+        name='survey_metrics'),
+    url(r'^survey/slow_queries$',
+        views.slow_queries,
+        name='survey_slow_queries'),
     url(r'^survey/create$',
         views.create_survey,
         name='create_survey'),
@@ -25,6 +36,15 @@ urlpatterns = [
     url(r'^survey/(?P<sid>\d+)/delete',
         views.delete_survey,
         name='delete_survey'),
+    url(r'^survey/(?P<sid>\d+)/results$',
+        views.survey_results_page,
+        name='survey_results'),
+    url(r'^survey/(?P<sid>\d+)/results\.json$',
+        views.survey_results_json,
+        name='survey_results_json'),
+    url(r'^survey/(?P<sid>\d+)/report$',
+        views.survey_report,
+        name='survey_report'),
     url(r'^survey/(?P<sid>\d+)/edit/questions$',
         views.edit_survey_questions,
         name='edit_survey_questions'),
@@ -44,7 +64,7 @@ urlpatterns = [
         views.add_survey,
         name='add_survey'),
     url(r'^engagement/(?P<eid>\d+)/survey/(?P<sid>\d+)/answer',
-        views.answer_survey,
+        answer_views.answer_survey,
         name='answer_survey'),
     url(r'^engagement/(?P<eid>\d+)/survey/(?P<sid>\d+)/delete',
         views.delete_engagement_survey,
@@ -70,7 +90,7 @@ urlpatterns = [
         views.delete_general_survey,
         name='delete_general_survey'),
     url(r'^empty_survey/(?P<esid>\d+)/answer$',
-        views.answer_empty_survey,
+        answer_views.answer_empty_survey,
         name='answer_empty_survey'),
     url(r'^empty_survey/(?P<esid>\d+)/new_engagement$',
         views.engagement_empty_survey,
@@ -10,8 +10,10 @@ from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Count
 from django.urls import reverse
-from django.http.response import HttpResponseRedirect, HttpResponse, Http404
+from django.http.response import HttpResponseRedirect, HttpResponse, Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.utils.html import escape
 from pytz import timezone
@@ -20,13 +22,23 @@ from django.utils import timezone as tz
 
 from defectDojo_engagement_survey.filters import SurveyFilter, QuestionFilter
 from defectDojo_engagement_survey.models import Question
-from dojo.models import Engagement, System_Settings
+from dojo.models import Engagement
 from dojo.utils import add_breadcrumb, get_page_items
 from .forms import Add_Survey_Form, Delete_Survey_Form, CreateSurveyForm, Delete_Eng_Survey_Form, \
     EditSurveyQuestionsForm, CreateQuestionForm, CreateTextQuestionForm, AssignUserForm, \
     CreateChoiceQuestionForm, EditTextQuestionForm, EditChoiceQuestionForm, AddChoicesForm, \
-    AddEngagementForm, AddGeneralSurveyForm, DeleteGeneralSurveyForm
-from .models import Answered_Survey, Engagement_Survey, Answer, TextQuestion, ChoiceQuestion, Choice, General_Survey
+    AddEngagementForm, AddGeneralSurveyForm, DeleteGeneralSurveyForm, SurveyReportForm
+from .models import Answered_Survey, Engagement_Survey, TextQuestion, ChoiceQuestion, Choice, General_Survey, \
+    available_surveys, forget_available_surveys
+from .access import is_authorized, system_settings
+from .answers import SurveyAnswers, mark_completed, reset_completion, save_answers
+from .intake import enqueue_submission, intake_enabled
+from .deletion import delete_answered_surveys, delete_preview, delete_survey_with_answers
+from .reports import SurveyReport
+from .pages import CSRF_PLACEHOLDER, get_blank_page, is_cacheable, set_blank_page
+from .statistics import record_statistics, survey_results
+from .metrics import GENERAL_RESPONSES, REGISTRY, SUBMISSIONS, metrics_enabled
+from .slowqueries import SLOW_QUERIES, slow_query_threshold
 
 localtz = timezone('America/Chicago')
 
@@ -43,13 +55,7 @@ def delete_engagement_survey(request, eid, sid):
     if request.method == 'POST':
         form = Delete_Survey_Form(request.POST, instance=survey)
         if form.is_valid():
-            answers = Answer.objects.filter(
-                question__in=[
-                    question.id for question in survey.survey.questions.all()],
-                answered_survey=survey)
-            for answer in answers:
-                answer.delete()
-            survey.delete()
+            delete_answered_surveys(Answered_Survey.objects.filter(id=survey.id))
             messages.add_message(request,
                                  messages.SUCCESS,
                                  'Survey deleted successfully.',
@@ -70,14 +76,23 @@ def delete_engagement_survey(request, eid, sid):
 
 
 def answer_survey(request, eid, sid):
-    survey = get_object_or_404(Answered_Survey, id=sid)
-    engagement = get_object_or_404(Engagement, id=eid)
-    prod = engagement.product
-    settings = System_Settings.objects.all()[0]
+    survey = get_object_or_404(Answered_Survey.objects.select_related('survey'), id=sid)
+    engagement = get_object_or_404(Engagement.objects.select_related('product'), id=eid)
+    settings = system_settings(request)
+
+    check_answer_permission(request, settings, engagement.product)
 
+    answers = SurveyAnswers(survey.survey, answered_survey=survey)
+    return respond_answer_survey(request, engagement, survey, answers)
+
+
+def check_answer_permission(request, settings, product=None):
+    '''
+    Raises PermissionDenied unless anonymous responses are enabled or the
+    user may answer surveys of the product, staff only without a product
+    '''
     if not settings.allow_anonymous_survey_repsonse:
-        auth = request.user.is_staff or request.user in prod.authorized_users.all()
-        if not auth:
+        if not is_authorized(request.user, product):
             messages.add_message(request,
                                  messages.ERROR,
                                  'You must be logged in to answer survey. Otherwise, enable anonymous response in system settings.',
@@ -85,31 +100,22 @@ def answer_survey(request, eid, sid):
             # will render 403
             raise PermissionDenied
 
-    questions = get_answered_questions(survey=survey, read_only=False)
+
+def respond_answer_survey(request, engagement, survey, answers):
+    '''
+    Renders or saves an engagement survey once everything is looked up,
+    shared with async_views
+    '''
+    questions = answers.forms(request.POST or None)
 
     if request.method == 'POST':
-        questions = [
-            q.get_form()(request.POST or None,
-                         prefix=str(q.id),
-                         answered_survey=survey,
-                         question=q, form_tag=False)
-            for q in survey.survey.questions.all()
-                    ]
-
-        questions_are_valid = []
-
-        for question in questions:
-            valid = question.is_valid()
-            questions_are_valid.append(valid)
-            if valid:
-                question.save()
-
-        questions_are_valid = all(questions_are_valid)
+        # validate every question before writing any answer
+        questions_are_valid = all([question.is_valid() for question in questions])
         if questions_are_valid:
-            survey.completed = True
-            survey.responder = request.user
-            survey.answered_on = date.today()
-            survey.save()
+            with transaction.atomic():
+                save_answers(survey, questions)
+                mark_completed(survey, request.user)
+            SUBMISSIONS.inc('completed')
             messages.add_message(request,
                                  messages.SUCCESS,
                                  'Successfully answered, all answers valid.',
@@ -117,6 +123,7 @@ def answer_survey(request, eid, sid):
             return HttpResponseRedirect(
                     reverse('view_engagement', args=(engagement.id, )))
         else:
+            SUBMISSIONS.inc('invalid')
             messages.add_message(request,
                                  messages.ERROR,
                                  'Survey has errors, please correct.',
@@ -136,8 +143,7 @@ def assign_survey(request, eid, sid):
     engagement = get_object_or_404(Engagement, id=eid)
     prod = engagement.product
 
-    auth = request.user.is_staff or request.user in prod.authorized_users.all()
-    if not auth:
+    if not is_authorized(request.user, prod):
         # will render 403
         raise PermissionDenied
 
@@ -177,34 +183,23 @@ def get_answered_questions(survey=None, read_only=False):
     if survey is None:
         return None
 
-    questions = [q.get_form()(prefix=str(q.id),
-                              answered_survey=survey,
-                              question=q, form_tag=False)
-                 for q in survey.survey.questions.all()
-                 ]
-    if read_only:
-        for question in questions:
-            question.fields['answer'].widget.attrs = {"readonly": "readonly",
-                                                      "disabled": "disabled"}
-
-    return questions
+    answers = SurveyAnswers(survey.survey, answered_survey=survey)
+    return answers.forms(read_only=read_only)
 
 
 @user_passes_test(lambda u: u.is_staff)
 def add_survey(request, eid):
     user = request.user
     engagement = get_object_or_404(Engagement, id=eid)
-    ids = [survey.survey.id for survey in
-           Answered_Survey.objects.filter(engagement=engagement)]
-    surveys = Engagement_Survey.objects.exclude(
-        id__in=ids)
-    form = Add_Survey_Form()
+    surveys = available_surveys(engagement)
+    form = Add_Survey_Form(surveys=surveys)
     if request.method == 'POST':
-        form = Add_Survey_Form(request.POST)
+        form = Add_Survey_Form(request.POST, surveys=surveys)
         if form.is_valid():
             survey = form.save(commit=False)
             survey.engagement = engagement
             survey.save()
+            forget_available_surveys(engagement)
             messages.add_message(request,
                                  messages.SUCCESS,
                                  'Survey successfully added, answers pending.',
@@ -219,7 +214,6 @@ def add_survey(request, eid):
                                  messages.ERROR,
                                  'Survey could not be added.',
                                  extra_tags='alert-danger')
-    form.fields["survey"].queryset = surveys
     add_breadcrumb(title="Add Survey", top_level=False, request=request)
     return render(request, 'defectDojo-engagement-survey/add_survey.html',
                   {'surveys': surveys,
@@ -282,18 +276,21 @@ def delete_survey(request, sid):
     survey = get_object_or_404(Engagement_Survey, id=sid)
     form = Delete_Eng_Survey_Form(instance=survey)
 
-    from django.contrib.admin.utils import NestedObjects
-    from django.db import DEFAULT_DB_ALIAS
+    preview = delete_preview(survey)
 
-    collector = NestedObjects(using=DEFAULT_DB_ALIAS)
-    collector.collect([survey])
-    rels = collector.nested()
+    # answered instances are only listed on request, a page at a time
+    answered = None
+    if 'answered' in request.GET:
+        answered = get_page_items(request,
+                                  Answered_Survey.objects.filter(survey=survey).select_related(
+                                      'engagement__product', 'responder').order_by('id'),
+                                  25)
 
     if request.method == 'POST':
         if 'id' in request.POST and str(survey.id) == request.POST['id']:
             form = Delete_Eng_Survey_Form(request.POST, instance=survey)
             if form.is_valid():
-                survey.delete()
+                delete_survey_with_answers(survey)
                 messages.add_message(request,
                                      messages.SUCCESS,
                                      'Survey and relationships removed.',
@@ -303,7 +300,8 @@ def delete_survey(request, sid):
     return render(request, 'defectDojo-engagement-survey/delete_survey.html',
                   {'survey': survey,
                    'form': form,
-                   'rels': rels,
+                   'preview': preview,
+                   'answered': answered,
                    })
 
 
@@ -342,8 +340,7 @@ def create_survey(request):
 def edit_survey_questions(request, sid):
     survey = get_object_or_404(Engagement_Survey, id=sid)
 
-    answered_surveys = Answered_Survey.objects.filter(survey=survey)
-    reverted = False
+    reverted = 0
 
     form = EditSurveyQuestionsForm(instance=survey)
 
@@ -351,17 +348,18 @@ def edit_survey_questions(request, sid):
         form = EditSurveyQuestionsForm(request.POST, instance=survey)
 
         if form.is_valid():
+            old_questions = set(survey.questions.values_list('id', flat=True))
             form.save()
-            for answered_survey in answered_surveys:
-                answered_survey.completed = False
-                answered_survey.answered_on = None
-                answered_survey.save()
-                reverted = True
+
+            # answers only go stale when the set of questions changed
+            if set(form.cleaned_data['questions'].values_list('id', flat=True)) != old_questions:
+                reverted = reset_completion(Answered_Survey.objects.filter(survey=survey))
 
             if reverted:
                 messages.add_message(request,
                                      messages.SUCCESS,
-                                     'Answered surveys associated with this survey have been set to uncompleted.',
+                                     '%d answered surveys associated with this survey have been set to uncompleted.'
+                                     % reverted,
                                      extra_tags='alert-warning')
             messages.add_message(request,
                                  messages.SUCCESS,
@@ -384,14 +382,11 @@ def edit_survey_questions(request, sid):
 @user_passes_test(lambda u: u.is_staff)
 def survey(request):
     user = request.user
-    surveys = Engagement_Survey.objects.all()
+    surveys = Engagement_Survey.objects.annotate(question_count=Count('questions'))
     surveys = SurveyFilter(request.GET, queryset=surveys)
     paged_surveys = get_page_items(request, surveys.qs, 25)
-    general_surveys = General_Survey.objects.all()
-    for survey in general_surveys:
-        survey_exp = survey.expiration
-        if survey.expiration < tz.now():
-            survey.delete()
+    # expired surveys are deleted by the sweep_general_surveys command
+    general_surveys = General_Survey.objects.open().select_related('survey').with_response_counts()
 
     add_breadcrumb(title="All Surveys", top_level=True, request=request)
     return render(request, 'defectDojo-engagement-survey/list_surveys.html',
@@ -402,6 +397,74 @@ def survey(request):
                    })
 
 
+@user_passes_test(lambda u: u.is_staff)
+def survey_results_page(request, sid):
+    survey = get_object_or_404(Engagement_Survey, id=sid)
+    add_breadcrumb(title=survey.name + " Survey Results", top_level=False, request=request)
+    return render(request, 'defectDojo-engagement-survey/survey_results.html',
+                  {'survey': survey,
+                   'results': survey_results(survey),
+                   })
+
+
+@user_passes_test(lambda u: u.is_staff)
+def survey_results_json(request, sid):
+    survey = get_object_or_404(Engagement_Survey, id=sid)
+    return JsonResponse(survey_results(survey))
+
+
+@user_passes_test(lambda u: u.is_staff)
+def survey_report(request, sid):
+    survey = get_object_or_404(Engagement_Survey, id=sid)
+    form = SurveyReportForm(request.GET)
+
+    report = None
+    if form.is_valid():
+        report = SurveyReport.load(survey,
+                                   products=form.cleaned_data['products'],
+                                   start=form.cleaned_data['start'],
+                                   end=form.cleaned_data['end'],
+                                   completed_only=not form.cleaned_data['include_incomplete'])
+        export = request.GET.get('format')
+        if export == 'json':
+            return JsonResponse(report.as_dict())
+        if export == 'csv':
+            response = HttpResponse(content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="survey-%s-report.csv"' % survey.id
+            report.write_csv(response)
+            return response
+
+    add_breadcrumb(title=survey.name + " Survey Report", top_level=False, request=request)
+    return render(request, 'defectDojo-engagement-survey/survey_report.html',
+                  {'survey': survey,
+                   'form': form,
+                   'report': report,
+                   'query': request.GET.urlencode(),
+                   })
+
+
+@user_passes_test(lambda u: u.is_staff)
+def survey_metrics(request):
+    if not metrics_enabled():
+        raise Http404('Survey metrics are disabled')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@user_passes_test(lambda u: u.is_staff)
+def slow_queries(request):
+    threshold = slow_query_threshold()
+    if threshold is None:
+        raise Http404('Slow queries are not captured')
+    if request.method == 'POST':
+        SLOW_QUERIES.clear()
+        return HttpResponseRedirect(reverse('survey_slow_queries'))
+    add_breadcrumb(title="Slow Survey Queries", top_level=False, request=request)
+    return render(request, 'defectDojo-engagement-survey/slow_queries.html',
+                  {'threshold': threshold,
+                   'queries': SLOW_QUERIES.worst(),
+                   })
+
+
 @user_passes_test(lambda u: u.is_staff)
 def questions(request):
     user = request.user
@@ -491,17 +554,16 @@ def edit_question(request, qid):
     error = False
 
     question = get_object_or_404(Question, id=qid)
-    survey = Engagement_Survey.objects.filter(questions__in=[question])
-    reverted = False
+    reverted = 0
 
-    if survey:
-        answered = Answered_Survey.objects.filter(survey__in=survey)
-        if answered.count() > 0:
-            messages.add_message(request,
-                                 messages.ERROR,
-                                 'This question is part of an already answered survey. If you change it, the responses '
-                                 'may no longer be valid.',
-                                 extra_tags='alert-info')
+    # only surveys holding an answer to this question are affected by an edit
+    answered = Answered_Survey.objects.filter(answer__question=question)
+    if answered.exists():
+        messages.add_message(request,
+                             messages.ERROR,
+                             'This question is part of an already answered survey. If you change it, the responses '
+                             'may no longer be valid.',
+                             extra_tags='alert-info')
 
     type = str(ContentType.objects.get_for_model(question))
 
@@ -523,16 +585,14 @@ def edit_question(request, qid):
         if form.is_valid():
             form.save()
 
-            for answered_survey in answered:
-                answered_survey.completed = False
-                answered_survey.answered_on = None
-                answered_survey.save()
-                reverted = True
+            if form.has_changed():
+                reverted = reset_completion(answered)
 
             if reverted:
                 messages.add_message(request,
                                      messages.SUCCESS,
-                                     'Answered surveys associated with this survey have been set to uncompleted.',
+                                     '%d answered surveys associated with this question have been set to uncompleted.'
+                                     % reverted,
                                      extra_tags='alert-warning')
 
             messages.add_message(request,
@@ -576,11 +636,11 @@ def add_choices(request):
 @user_passes_test(lambda u: u.is_staff)
 def add_empty_survey(request):
     user = request.user
-    surveys = Engagement_Survey.objects.all()
-    form = AddGeneralSurveyForm()
+    surveys = list(Engagement_Survey.objects.all())
+    form = AddGeneralSurveyForm(surveys=surveys)
     engagement = None
     if request.method == 'POST':
-        form = AddGeneralSurveyForm(request.POST)
+        form = AddGeneralSurveyForm(request.POST, surveys=surveys)
         if form.is_valid():
             survey = form.save(commit=False)
             survey.generated = tz.now()
@@ -598,7 +658,6 @@ def add_empty_survey(request):
                                  messages.ERROR,
                                  'Survey could not be added.',
                                  extra_tags='alert-danger')
-    form.fields["survey"].queryset = surveys
     add_breadcrumb(title="Add Empty Survey", top_level=False, request=request)
     return render(request, 'defectDojo-engagement-survey/add_survey.html',
                   {'surveys': surveys,
@@ -635,13 +694,7 @@ def delete_empty_survey(request, esid):
     if request.method == 'POST':
         form = Delete_Survey_Form(request.POST, instance=survey)
         if form.is_valid():
-            answers = Answer.objects.filter(
-                question__in=[
-                    question.id for question in survey.survey.questions.all()],
-                answered_survey=survey)
-            for answer in answers:
-                answer.delete()
-            survey.delete()
+            delete_answered_surveys(Answered_Survey.objects.filter(id=survey.id))
             messages.add_message(request,
                                  messages.SUCCESS,
                                  'Survey deleted successfully.',
@@ -693,55 +746,53 @@ def delete_general_survey(request, esid):
 
 
 def answer_empty_survey(request, esid):
-    general_survey = get_object_or_404(General_Survey, id=esid)
-    engagement_survey = get_object_or_404(Engagement_Survey, id=general_survey.survey_id)
-    engagement, survey = None, None
-    
-    settings = System_Settings.objects.all()[0]
+    # anonymous respondents share one cached blank page
+    page = get_blank_page(request, esid)
+    if page is not None:
+        return page
+
+    # expired surveys can't be answered, cached pages expire with their survey
+    general_survey = get_object_or_404(General_Survey.objects.open().select_related('survey'), id=esid)
+    settings = system_settings(request)
+
+    check_answer_permission(request, settings)
+
+    # a blank survey has no answers to look up
+    answers = SurveyAnswers(general_survey.survey)
+    return respond_answer_empty_survey(request, general_survey, answers)
 
-    if not settings.allow_anonymous_survey_repsonse:
-        auth = request.user.is_staff
-        if not auth:
-            messages.add_message(request,
-                                 messages.ERROR,
-                                 'You must be logged in to answer survey. Otherwise, enable anonymous response in system settings.',
-                                 extra_tags='alert-danger')
-            # will render 403
-            raise PermissionDenied
 
-    questions = [q.get_form()(prefix=str(q.id),
-                              engagement_survey=engagement_survey,
-                              question=q, form_tag=False)
-                 for q in engagement_survey.questions.all()
-                 ]
+def respond_answer_empty_survey(request, general_survey, answers):
+    '''
+    Renders or records a response to a general survey once everything is
+    looked up, shared with async_views
+    '''
+    engagement_survey = general_survey.survey
+    engagement, survey = None, None
+
+    questions = answers.forms(request.POST or None)
 
     if request.method == 'POST':
-        survey = Answered_Survey(survey=engagement_survey)
-        survey.save()
-        questions = [
-            q.get_form()(request.POST or None,
-                         prefix=str(q.id),
-                         answered_survey=survey,
-                         question=q, form_tag=False)
-            for q in survey.survey.questions.all()
-                    ]
-
-        questions_are_valid = []
-
-        for question in questions:
-            valid = question.is_valid()
-            questions_are_valid.append(valid)
-            if valid:
-                question.save()
-
-        questions_are_valid = all(questions_are_valid)
+        # validate every question before creating the survey and its answers
+        questions_are_valid = all([question.is_valid() for question in questions])
         if questions_are_valid:
-            survey.completed = True
-            survey.responder = request.user if not request.user.is_anonymous else None
-            survey.answered_on = date.today()
-            survey.save()
-            general_survey.num_responses = general_survey.num_responses + 1
-            general_survey.save()
+            responder = request.user if not request.user.is_anonymous else None
+            if intake_enabled():
+                # written out later by the intake worker
+                enqueue_submission(general_survey, responder, questions)
+                SUBMISSIONS.inc('queued')
+            else:
+                with transaction.atomic():
+                    survey = Answered_Survey(survey=engagement_survey, general_survey=general_survey)
+                    survey.completed = True
+                    survey.responder = responder
+                    survey.answered_on = date.today()
+                    survey.save()
+                    # counted through survey.general_survey, see General_Survey.response_count
+                    save_answers(survey, questions)
+                    record_statistics({(engagement_survey.id, 0, 0): 1})
+                SUBMISSIONS.inc('completed')
+            GENERAL_RESPONSES.inc(general_survey.id)
             if request.user.is_anonymous:
                 message = 'Your responses have been recorded.'
             else:
@@ -754,6 +805,7 @@ def answer_empty_survey(request, esid):
             return HttpResponseRedirect(
                     reverse('dashboard'))
         else:
+            SUBMISSIONS.inc('invalid')
             messages.add_message(request,
                                  messages.ERROR,
                                  'Survey has errors, please correct.',
@@ -761,18 +813,23 @@ def answer_empty_survey(request, esid):
     add_breadcrumb(title="Answer Empty " + engagement_survey.name + " Survey", top_level=False, request=request)
     if survey is None:
         survey = engagement_survey
+    context = {'survey': survey,
+               'engagement': engagement,
+               'questions': questions,
+               }
+    if is_cacheable(request):
+        context['csrf_token'] = CSRF_PLACEHOLDER
+        return set_blank_page(request, general_survey,
+                              render(request, 'defectDojo-engagement-survey/answer_survey.html', context))
     return render(request,
                   'defectDojo-engagement-survey/answer_survey.html',
-                  {'survey': survey,
-                   'engagement': engagement,
-                   'questions': questions,
-                   })
+                  context)
 
 
 def engagement_empty_survey(request, esid):
     survey = get_object_or_404(Answered_Survey, id=esid)
     engagement = None
-    settings = System_Settings.objects.all()[0]
+    settings = system_settings(request)
     form = AddEngagementForm()
 
     if not settings.allow_anonymous_survey_repsonse:
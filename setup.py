@@ -35,5 +35,10 @@ setup(
         'django-crispy-forms',
         'django-overextends',
         'django_extensions',
-                    ]
+                    ],
+    extras_require={
+        'reports': ['numpy'],
+        # async_views.py, url() and ugettext_lazy keep the app below 4.0
+        'async': ['Django>=3.1,<4.0'],
+    },
 )